@@ -0,0 +1,91 @@
+import io
+import os
+import re
+from PIL import Image, ImageDraw, ImageFont
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+# screenshots in the corpus are named after the time they show, e.g. 01-45.png or 1-02-03_pixel.jpg
+NAMED_TIME = re.compile(r"^((\d+-)?[0-5][0-9]-[0-5][0-9])")
+
+
+def expected_time(filename: str):
+    """
+    Returns the solve time a corpus screenshot shows according to its filename, or None if it isn't named after one.
+
+    Arguments:
+        filename (str): name of the screenshot file
+    """
+
+    match = NAMED_TIME.match(os.path.basename(filename))
+    return match.group(1).replace("-", ":") if match else None
+
+
+def load(directory: str = CORPUS_DIR) -> [(str, bytes, str)]:
+    """
+    Returns (name, image bytes, expected time) for every screenshot in the corpus directory.
+
+    Arguments:
+        directory (str): directory holding the screenshots
+    """
+
+    if not os.path.isdir(directory):
+        return []
+
+    screenshots = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, filename), "rb") as file:
+                screenshots.append((filename, file.read(), expected_time(filename)))
+    return screenshots
+
+
+def synthetic_screenshot(time: str, width: int = 1080, height: int = 2340) -> bytes:
+    """
+    Draws a phone-sized PNG laid out like a PlusWord completion screen, with the banner and the solve time below it.
+
+    Arguments:
+        time (str): solve time to show
+        width (int): image width in pixels
+        height (int): image height in pixels
+    """
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    title = ImageFont.load_default(size=width // 12)
+    text = ImageFont.load_default(size=width // 22)
+    digits = ImageFont.load_default(size=width // 10)
+
+    draw.rectangle((0, 0, width, height // 10), fill=(0, 51, 102))
+    draw.text((width // 2, height // 20), "PlusWord", font=title, fill="white", anchor="mm")
+    # a grid stand-in so the page isn't just text
+    cell = width // 8
+    for row in range(5):
+        for column in range(5):
+            left = width // 2 - cell * 5 // 2 + column * cell
+            top = height // 6 + row * cell
+            draw.rectangle((left, top, left + cell - 6, top + cell - 6), outline="black", width=3)
+
+    top = height // 6 + cell * 5 + height // 20
+    draw.text((width // 2, top), "You completed today's PlusWord in", font=text, fill="black", anchor="mt")
+    draw.text((width // 2, top + width // 22 * 2), time, font=digits, fill="black", anchor="mt")
+
+    data = io.BytesIO()
+    image.save(data, format="PNG")
+    return data.getvalue()
+
+
+def synthetic(count: int) -> [(str, bytes, str)]:
+    """
+    Returns (name, image bytes, expected time) for a number of synthetic screenshots with varied times.
+
+    Arguments:
+        count (int): number of screenshots to draw
+    """
+
+    screenshots = []
+    for index in range(count):
+        seconds = 45 + index * 37 % 600
+        time = f"{seconds // 60:02}:{seconds % 60:02}"
+        screenshots.append((f"synthetic-{index}.png", synthetic_screenshot(time), time))
+    return screenshots
@@ -0,0 +1,141 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MEDIA_PATH = re.compile(r"^/media/(?P<media_id>[^/]+)$")
+MEDIA_INFO_PATH = re.compile(r"^/(?P<media_id>[^/]+)$")
+MESSAGES_PATH = re.compile(r"^/(?P<page_id>[^/]+)/messages$")
+
+
+class FakeGraphServer:
+    """
+    Local stand-in for the WhatsApp Graph API. Accepts sent messages, recording when each recipient was replied to,
+    and serves media from an in-memory corpus.
+
+    Attributes:
+        url (str): base url to point PLUSWORD_GRAPH_API_URL at
+        media (dict): media id: image bytes served for downloads
+        latency (float): seconds every response is delayed by, to mimic the real API's round trip
+    """
+
+    def __init__(self, media: dict = None, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Constructor for FakeGraphServer class.
+
+        Arguments:
+            media (dict): media id: image bytes served for downloads
+            latency (float): seconds every response is delayed by
+            host (str): address to listen on
+            port (int): port to listen on, 0 picks a free one
+        """
+
+        self.media = media or {}
+        self.latency = latency
+        self._replies = {}
+        self._condition = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, status: int, body: bytes, content_type: str = "application/json"):
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not MESSAGES_PATH.match(self.path):
+                    self._respond(404, b"{}")
+                    return
+                message = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                server.record_reply(message.get("to"), message.get("text", {}).get("body"))
+                self._respond(200, json.dumps({"messages": [{"id": "wamid.fake"}]}).encode())
+
+            def do_GET(self):
+                if match := MEDIA_PATH.match(self.path):
+                    data = server.media.get(match.group("media_id"))
+                    if data is None:
+                        self._respond(404, b"{}")
+                    else:
+                        self._respond(200, data, "image/png")
+                elif match := MEDIA_INFO_PATH.match(self.path):
+                    url = f"{server.url}/media/{match.group('media_id')}"
+                    self._respond(200, json.dumps({"url": url}).encode())
+                else:
+                    self._respond(404, b"{}")
+
+        return Handler
+
+    def record_reply(self, phone_number: str, text: str):
+        """
+        Records a message sent to a recipient and wakes anyone waiting for it.
+
+        Arguments:
+            phone_number (str): phone number of the recipient
+            text (str): text message body
+        """
+
+        with self._condition:
+            self._replies.setdefault(phone_number, []).append((time.perf_counter(), text))
+            self._condition.notify_all()
+
+    def wait_for_reply(self, phone_number: str, count: int = 1, timeout: float = 30.0):
+        """
+        Blocks until a recipient has been sent count messages, returning (perf_counter time, text) of the count-th,
+        or None on timeout.
+
+        Arguments:
+            phone_number (str): phone number of the recipient
+            count (int): number of messages to wait for
+            timeout (float): seconds to wait
+        """
+
+        deadline = time.perf_counter() + timeout
+        with self._condition:
+            while len(self._replies.get(phone_number, [])) < count:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            return self._replies[phone_number][count - 1]
+
+    def replies(self, phone_number: str) -> list:
+        """
+        Returns every (perf_counter time, text) sent to a recipient.
+
+        Arguments:
+            phone_number (str): phone number of the recipient
+        """
+
+        with self._condition:
+            return list(self._replies.get(phone_number, []))
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-graph-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving.
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
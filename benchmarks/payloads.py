@@ -0,0 +1,145 @@
+import copy
+import datetime
+import itertools
+import json
+import os
+
+RECORDED_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+
+_message_ids = itertools.count()
+
+
+def message(phone_number: str, message_type: str, content: dict) -> dict:
+    """
+    Returns one WhatsApp webhook message with a unique id.
+
+    Arguments:
+        phone_number (str): phone number of the sender
+        message_type (str): message type, e.g. text or image
+        content (dict): the message's type-specific body
+    """
+
+    return {
+        "from": phone_number,
+        "id": f"wamid.benchmark.{os.getpid()}.{next(_message_ids)}",
+        "timestamp": str(int(datetime.datetime.now().timestamp())),
+        "type": message_type,
+        message_type: content,
+    }
+
+
+def webhook(*messages: dict, name: str = "Benchmark") -> dict:
+    """
+    Wraps messages in a webhook payload as Meta delivers it, with a contact entry for each sender.
+
+    Arguments:
+        messages (dict): messages to deliver together
+        name (str): profile name given to every sender
+    """
+
+    senders = dict.fromkeys(message["from"] for message in messages)
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "0",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "0", "phone_number_id": "0"},
+                    "contacts": [{"profile": {"name": f"{name} {sender}"}, "wa_id": sender} for sender in senders],
+                    "messages": list(messages),
+                },
+            }],
+        }],
+    }
+
+
+def text(phone_number: str, body: str) -> dict:
+    """
+    Returns a webhook payload holding one text message.
+
+    Arguments:
+        phone_number (str): phone number of the sender
+        body (str): message text
+    """
+
+    return webhook(message(phone_number, "text", {"body": body}))
+
+
+def image(phone_number: str, media_id: str) -> dict:
+    """
+    Returns a webhook payload holding one image message.
+
+    Arguments:
+        phone_number (str): phone number of the sender
+        media_id (str): id the fake Graph API serves the image under
+    """
+
+    return webhook(message(phone_number, "image", {"id": media_id, "mime_type": "image/png"}))
+
+
+def retro_date(index: int) -> str:
+    """
+    Returns a distinct past date for the index-th retro submission, formatted for !retro.
+
+    Arguments:
+        index (int): number of the retro submission
+    """
+
+    day = datetime.datetime.now() - datetime.timedelta(days=30 + index)
+    return day.strftime("%d-%m-%Y:12:00")
+
+
+# command: builds the payload for the index-th sender
+COMMANDS = {
+    "submit": lambda phone_number, index: text(phone_number, f"!submit {1 + index % 9:02}:{index % 60:02}"),
+    "edit": lambda phone_number, index: text(phone_number, f"!edit {index % 9:02}:{(index * 7) % 60:02}"),
+    "retro": lambda phone_number, index: text(phone_number, f"!retro {retro_date(index)} 02:{index % 60:02}"),
+    "reminder": lambda phone_number, index: text(phone_number, f"!reminder enable {index % 24:02}:00"),
+    "motivation": lambda phone_number, index: text(phone_number, "!motivation set 01:30"),
+    "leaderboard": lambda phone_number, index: text(phone_number, "!leaderboard"),
+    "stats": lambda phone_number, index: text(phone_number, "!stats"),
+    "pb": lambda phone_number, index: text(phone_number, "!pb"),
+}
+
+
+def load_recorded(directory: str = RECORDED_DIR) -> {str: dict}:
+    """
+    Returns the recorded webhook payloads saved as <name>.json in the payloads directory.
+
+    Arguments:
+        directory (str): directory holding the recorded payloads
+    """
+
+    if not os.path.isdir(directory):
+        return {}
+
+    recorded = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            with open(os.path.join(directory, filename)) as file:
+                recorded[filename[:-len(".json")]] = json.load(file)
+    return recorded
+
+
+def replay(payload: dict, phone_number: str) -> dict:
+    """
+    Returns a copy of a recorded payload sent from another phone number and with fresh message ids, so it isn't
+    dropped as a redelivery.
+
+    Arguments:
+        payload (dict): recorded webhook payload
+        phone_number (str): phone number to send it from
+    """
+
+    payload = copy.deepcopy(payload)
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for contact in value.get("contacts", []):
+                contact["wa_id"] = phone_number
+            for recorded in value.get("messages", []):
+                recorded["from"] = phone_number
+                recorded["id"] = f"wamid.benchmark.{os.getpid()}.{next(_message_ids)}"
+    return payload
@@ -0,0 +1,369 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from benchmarks import corpus, payloads
+from benchmarks.fake_graph import FakeGraphServer
+
+DEFAULT_MONGO = "mongodb://localhost:27017"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+SECTIONS = ("webhook", "ocr", "reminders")
+
+# command: phone number group its senders come from. !edit, !stats and !pb reuse the !submit senders so they have
+# times to work on
+SENDER_GROUPS = {
+    "submit": 10, "edit": 10, "stats": 10, "pb": 10, "leaderboard": 10,
+    "image": 11, "retro": 12, "reminder": 13, "motivation": 14,
+}
+
+
+def phone_number(group: int, index: int) -> str:
+    return f"4470{group:02}{index:06}"
+
+
+def percentiles(samples: [float]) -> dict:
+    """
+    Summarises latency samples in seconds as milliseconds, using nearest-rank percentiles.
+
+    Arguments:
+        samples ([float]): latencies in seconds
+    """
+
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(percentile: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": rank(50),
+        "p95_ms": rank(95),
+        "p99_ms": rank(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def configure(args, graph: FakeGraphServer):
+    """
+    Points the bot at the local stand-ins through its environment overrides. Must run before the bot's modules are
+    imported.
+    """
+
+    host = urlparse(args.mongo).hostname
+    if host not in LOCAL_HOSTS and not args.allow_remote:
+        sys.exit(f"Refusing to benchmark against {host}: the PlusWord database is dropped first. "
+                 f"Use a local mongod or pass --allow-remote.")
+
+    os.environ["PLUSWORD_DB_CONNECTION_STRING"] = args.mongo
+    os.environ["PLUSWORD_GRAPH_API_URL"] = graph.url
+    os.environ.setdefault("PLUSWORD_WHATSAPP_KEY", "benchmark")
+    os.environ.setdefault("PLUSWORD_WHATSAPP_PAGE_ID", "benchmark")
+
+
+def reset_database():
+    """
+    Drops the PlusWord database and recreates its indexes.
+    """
+
+    import db as mongo
+    import schema
+
+    mongo.get_client().drop_database(schema.DATABASE)
+    for problem in schema.ensure_indexes():
+        print(f"warning: {problem}")
+
+
+def post(client, payload: dict) -> (float, int):
+    """
+    Posts a payload to the webhook, retrying while the work queue is full as Meta would.
+    Returns the seconds the webhook took to acknowledge it and the number of 503s received.
+    """
+
+    rejected = 0
+    while True:
+        started = time.perf_counter()
+        response = client.post("/", json=payload)
+        acknowledged = time.perf_counter() - started
+        if response.status_code != 503:
+            return acknowledged, rejected
+        rejected += 1
+        time.sleep(0.05)
+
+
+def bench_command(app, graph: FakeGraphServer, build, senders: [str], concurrency: int, timeout: float) -> dict:
+    """
+    Measures one command end to end: from posting the webhook until the sender's reply reaches the fake Graph API.
+    The first half of the senders are sent one at a time for latency, the second half all at once for throughput.
+    """
+
+    half = len(senders) // 2
+    latencies, acknowledgements, lost, rejected = [], [], 0, 0
+    client = app.test_client()
+
+    for index, sender in enumerate(senders[:half]):
+        expected = len(graph.replies(sender)) + 1
+        started = time.perf_counter()
+        acknowledged, retries = post(client, build(sender, index))
+        reply = graph.wait_for_reply(sender, expected, timeout)
+        acknowledgements.append(acknowledged)
+        rejected += retries
+        if reply is None:
+            lost += 1
+        else:
+            latencies.append(reply[0] - started)
+
+    burst = [(sender, len(graph.replies(sender)) + 1, build(sender, half + index))
+             for index, sender in enumerate(senders[half:])]
+    started = time.perf_counter()
+
+    def send(item):
+        sender, expected, payload = item
+        acknowledged, retries = post(app.test_client(), payload)
+        return sender, expected, acknowledged, retries
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        sent = list(executor.map(send, burst))
+    finished = started
+    for sender, expected, acknowledged, retries in sent:
+        acknowledgements.append(acknowledged)
+        rejected += retries
+        reply = graph.wait_for_reply(sender, expected, timeout)
+        if reply is None:
+            lost += 1
+        else:
+            finished = max(finished, reply[0])
+    elapsed = finished - started
+
+    return {
+        "latency": percentiles(latencies),
+        "acknowledgement": percentiles(acknowledgements),
+        "throughput_per_s": (len(burst) - lost) / elapsed if elapsed > 0 else None,
+        "burst": len(burst),
+        "lost": lost,
+        "rejected_503": rejected,
+    }
+
+
+def bench_webhook(args, graph: FakeGraphServer, screenshots: list) -> dict:
+    """
+    Benchmarks every command, image submissions and any recorded payloads through the Flask test client.
+    """
+
+    from pluswordchatbot import app
+
+    for index, (name, data, _) in enumerate(screenshots):
+        graph.media[f"media-{index}"] = data
+
+    commands = dict(payloads.COMMANDS)
+    commands["image"] = lambda sender, index: payloads.image(sender, f"media-{index % len(screenshots)}")
+    order = ["submit", "image", "edit", "retro", "reminder", "motivation", "stats", "pb", "leaderboard"]
+    if not screenshots:
+        order.remove("image")
+
+    results = {}
+    for name in order:
+        senders = [phone_number(SENDER_GROUPS[name], index) for index in range(args.messages)]
+        results[name] = bench_command(app, graph, commands[name], senders, args.concurrency, args.timeout)
+        print(f"{name:>12}: {summary(results[name])}")
+
+    for index, (name, recorded) in enumerate(payloads.load_recorded().items()):
+        senders = [phone_number(50 + index, number) for number in range(args.messages)]
+        build = lambda sender, _, recorded=recorded: payloads.replay(recorded, sender)
+        results[f"recorded:{name}"] = bench_command(app, graph, build, senders, args.concurrency, args.timeout)
+        print(f"{'recorded:' + name:>12}: {summary(results[f'recorded:{name}'])}")
+
+    return results
+
+
+def summary(result: dict) -> str:
+    latency = result["latency"]
+    if not latency["count"]:
+        return f"no replies, {result['lost']} lost"
+    throughput = result["throughput_per_s"]
+    return (f"p50 {latency['p50_ms']:.1f}ms p95 {latency['p95_ms']:.1f}ms p99 {latency['p99_ms']:.1f}ms, "
+            f"{throughput:.1f}/s" + (f", {result['lost']} lost" if result["lost"] else ""))
+
+
+def ocr_unavailable(screenshots: list):
+    """
+    Returns why OCR can't run here, e.g. tesseract isn't installed, or None if it can.
+    """
+
+    import ocr
+
+    try:
+        ocr.read_time(screenshots[0][1])
+    except Exception as ex:
+        return f"OCR failed: {ex!r}"
+    return None
+
+
+def bench_ocr(screenshots: list, repeat: int) -> dict:
+    """
+    Measures raw OCR throughput and accuracy over the screenshots, without the OCR cache.
+    """
+
+    import ocr
+
+    durations, correct, checked = [], 0, 0
+    for _ in range(repeat):
+        for name, data, expected in screenshots:
+            started = time.perf_counter()
+            time_read = ocr.read_time(data)
+            durations.append(time.perf_counter() - started)
+            if expected is not None:
+                checked += 1
+                correct += time_read == expected
+
+    total = sum(durations)
+    result = {
+        "images": len(durations),
+        "images_per_s": len(durations) / total if total else None,
+        "latency": percentiles(durations),
+        "accuracy": correct / checked if checked else None,
+    }
+    print(f"{'ocr':>12}: {result['images_per_s']:.2f} images/s, accuracy {result['accuracy']}")
+    return result
+
+
+def seed_reminders(database, submissions: int):
+    """
+    Fills Times and Reminders with players who submitted yesterday inside the reminder window. Half of them have a
+    reminder due this minute and a tenth of those have already submitted today.
+    """
+
+    now = datetime.datetime.now()
+    today_start = datetime.datetime.combine(now.date(), datetime.time())
+    window_start = max(today_start - datetime.timedelta(days=1), now - datetime.timedelta(hours=23, minutes=59))
+    yesterday = window_start + (today_start - window_start) / 2
+    due = now.strftime("%H:%M")
+    other = (now + datetime.timedelta(hours=1)).strftime("%H:%M")
+
+    database["Times"].delete_many({})
+    database["Reminders"].delete_many({})
+    times, reminders = [], []
+    for index in range(submissions):
+        number = phone_number(90, index)
+        times.append({"phone_number": number, "user": number, "time": "01:00", "seconds": 60,
+                      "load_ts": yesterday, "puzzle_date": yesterday.date().isoformat()})
+        reminders.append({"phone_number": number, "enabled": True, "time": due if index % 2 == 0 else other})
+        if index % 20 == 0:
+            times.append({"phone_number": number, "user": number, "time": "01:00", "seconds": 60,
+                          "load_ts": now, "puzzle_date": now.date().isoformat()})
+    for start in range(0, len(times), 10000):
+        database["Times"].insert_many(times[start:start + 10000], ordered=False)
+    for start in range(0, len(reminders), 10000):
+        database["Reminders"].insert_many(reminders[start:start + 10000], ordered=False)
+
+
+def bench_reminders(counts: [int], repeat: int) -> list:
+    """
+    Measures get_reminders as the number of yesterday's submissions grows.
+    """
+
+    import db as mongo
+    from schedule_reminders import get_reminders
+
+    database = mongo.get_client()["PlusWord"]
+    results = []
+    for submissions in counts:
+        seed_reminders(database, submissions)
+        durations, due = [], 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            due = len(get_reminders())
+            durations.append(time.perf_counter() - started)
+        results.append({"submissions": submissions, "due": due, "latency": percentiles(durations)})
+        print(f"{'reminders':>12}: {submissions} submissions, {due} due, "
+              f"p50 {results[-1]['latency']['p50_ms']:.1f}ms")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PlusWord bot against local stand-ins.")
+    parser.add_argument("sections", nargs="*", choices=[*SECTIONS, []],
+                        help="what to benchmark, defaults to everything")
+    parser.add_argument("--mongo", default=DEFAULT_MONGO, help=f"local MongoDB to use (default {DEFAULT_MONGO})")
+    parser.add_argument("--allow-remote", action="store_true", help="allow a MongoDB that isn't on localhost")
+    parser.add_argument("--messages", type=int, default=200, help="messages sent per command (default 200)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent webhook deliveries (default 16)")
+    parser.add_argument("--graph-latency", type=float, default=0.05,
+                        help="seconds the fake Graph API takes to respond (default 0.05)")
+    parser.add_argument("--synthetic", type=int, default=20,
+                        help="synthetic screenshots to draw when the corpus is empty (default 20)")
+    parser.add_argument("--ocr-repeat", type=int, default=3, help="passes over the screenshots for OCR (default 3)")
+    parser.add_argument("--reminder-counts", type=int, nargs="+", default=[100, 1000, 10000, 50000],
+                        help="submission counts get_reminders is timed at")
+    parser.add_argument("--reminder-repeat", type=int, default=20, help="get_reminders runs per count (default 20)")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each reply (default 60)")
+    parser.add_argument("--output", help="file to save the JSON results to, defaults to benchmarks/results/")
+    args = parser.parse_args()
+    args.sections = args.sections or list(SECTIONS)
+
+    screenshots = corpus.load()
+    corpus_source = "corpus"
+    if not screenshots:
+        screenshots = corpus.synthetic(args.synthetic)
+        corpus_source = "synthetic"
+
+    graph = FakeGraphServer(latency=args.graph_latency).start()
+    configure(args, graph)
+    reset_database()
+
+    if error := ocr_unavailable(screenshots):
+        print(f"warning: skipping image submissions and OCR, {error}")
+        screenshots = []
+        args.sections = [section for section in args.sections if section != "ocr"]
+
+    results = {
+        "started_at": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"source": corpus_source, "screenshots": len(screenshots)},
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+    try:
+        if "webhook" in args.sections:
+            results["webhook"] = bench_webhook(args, graph, screenshots)
+        if "ocr" in args.sections:
+            results["ocr"] = bench_ocr(screenshots, args.ocr_repeat)
+        if "reminders" in args.sections:
+            results["reminders"] = bench_reminders(args.reminder_counts, args.reminder_repeat)
+    finally:
+        if "webhook" in args.sections:
+            from pluswordchatbot import work_queue
+            work_queue.shutdown(timeout=args.timeout)
+        graph.stop()
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{(results['commit'] or 'local')[:8]}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with least recently used eviction and a time to live on each entry.
+
+    Attributes:
+        maxsize (int): maximum number of entries held before the least recently used is evicted
+        ttl (float): seconds an entry stays valid after it is set
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        """
+        Constructor for TTLCache class.
+
+        Arguments:
+            maxsize (int): maximum number of entries held before the least recently used is evicted
+            ttl (float): seconds an entry stays valid after it is set
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for a key, or default if it is missing or expired.
+
+        Arguments:
+            key: cache key
+            default: value returned on a miss
+        """
+
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Caches a value, evicting the least recently used entry if the cache is full.
+
+        Arguments:
+            key: cache key
+            value: value to cache
+            ttl (float): seconds the entry stays valid, defaults to the cache ttl
+        """
+
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Removes a key from the cache and returns its value.
+
+        Arguments:
+            key: cache key
+            default: value returned if the key is not cached
+        """
+
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,15 @@
+import mongomock
+import pytest
+import db as mongo
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """
+    Points the shared client at an in-memory mongomock client and returns its PlusWord database.
+    """
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongo, "get_client", lambda: client)
+    monkeypatch.setattr(mongo, "get_collection", lambda database, collection: client[database][collection])
+    return client["PlusWord"]
@@ -1,38 +1,139 @@
+import dataclasses
 import json
+import logging
+import os
+import threading
+import time
+
+DB_ACCESS_PATH = "local/db_access.json"
+WHATSAPP_ACCESS_PATH = "local/whatsapp_access.json"
+
+# seconds between checks of the credential files' modification times
+RELOAD_INTERVAL = float(os.environ.get("PLUSWORD_CREDENTIALS_RELOAD_INTERVAL", 5))
+
+# credential name: (file, key in file, environment variable override)
+SOURCES = {
+    "db_connection_string": (DB_ACCESS_PATH, "connection_string", "PLUSWORD_DB_CONNECTION_STRING"),
+    "whatsapp_key": (WHATSAPP_ACCESS_PATH, "key", "PLUSWORD_WHATSAPP_KEY"),
+    "whatsapp_page_id": (WHATSAPP_ACCESS_PATH, "page_id", "PLUSWORD_WHATSAPP_PAGE_ID"),
+}
+
+
+class CredentialError(Exception):
+    """
+    Raised when a credential is missing or a credential file can't be read.
+    """
+
+
+@dataclasses.dataclass(frozen=True)
+class Credentials:
+    """
+    Immutable snapshot of the credentials the bot needs.
+
+    Attributes:
+        db_connection_string (str): MongoDB connection string
+        whatsapp_key (str): WhatsApp API key
+        whatsapp_page_id (str): WhatsApp page-id
+    """
+
+    db_connection_string: str
+    whatsapp_key: str
+    whatsapp_page_id: str
+
+
+_credentials = None
+_mtimes = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _file_mtimes() -> dict:
+    mtimes = {}
+    for path, _, _ in SOURCES.values():
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def load_credentials() -> Credentials:
+    """
+    Reads the credential files, applies environment variable overrides and returns the result.
+    Raises CredentialError if a credential file is unreadable or a credential is missing.
+    """
+
+    files = {}
+    values = {}
+    for name, (path, key, env_var) in SOURCES.items():
+        if os.environ.get(env_var):
+            values[name] = os.environ[env_var]
+            continue
+        if path not in files:
+            try:
+                with open(path) as file:
+                    files[path] = json.loads(file.read())
+            except FileNotFoundError:
+                files[path] = {}
+            except (OSError, ValueError) as e:
+                raise CredentialError(f"Could not read {path}: {e}") from e
+        values[name] = files[path].get(key)
+
+    missing = [name for name, value in values.items() if not value]
+    if missing:
+        raise CredentialError(f"Missing credentials: {', '.join(missing)}. "
+                              f"Set them in {DB_ACCESS_PATH}, {WHATSAPP_ACCESS_PATH} or the environment.")
+
+    return Credentials(**values)
+
+
+def get_credentials() -> Credentials:
+    """
+    Returns the cached credentials, reloading them only when a credential file's modification time has changed.
+    The first call raises CredentialError if credentials are missing, so call it at startup to fail fast. A failed
+    reload keeps the last good credentials.
+    """
+
+    global _credentials, _mtimes, _checked_at
+
+    now = time.monotonic()
+    if _credentials is not None and now - _checked_at < RELOAD_INTERVAL:
+        return _credentials
+
+    with _lock:
+        if _credentials is not None and now - _checked_at < RELOAD_INTERVAL:
+            return _credentials
+
+        mtimes = _file_mtimes()
+        if _credentials is None:
+            _credentials = load_credentials()
+        elif mtimes != _mtimes:
+            try:
+                _credentials = load_credentials()
+                logging.info("Reloaded credentials.")
+            except CredentialError as e:
+                logging.error(f"Keeping previous credentials, reload failed: {e}")
+        _mtimes = mtimes
+        _checked_at = now
+        return _credentials
 
 
 def get_db_connection_string() -> str:
     """
     Returns the database connection string.
     """
-    try:
-        with open("local/db_access.json") as file:
-            file = json.loads(file.read())
-            return file.get("connection_string")
-
-    except Exception as e:
-        print(e)
+    return get_credentials().db_connection_string
 
 
 def get_whatsapp_key() -> str:
     """
     Returns the whatsapp API key.
     """
-    try:
-        with open("local/whatsapp_access.json") as file:
-            file = json.loads(file.read())
-            return file.get("key")
-    except Exception as e:
-        print(e)
+    return get_credentials().whatsapp_key
 
 
 def get_whatsapp_page_id() -> str:
     """
     Returns the whatsapp page-id.
     """
-    try:
-        with open("local/whatsapp_access.json") as file:
-            file = json.loads(file.read())
-            return file.get("page_id")
-    except Exception as e:
-        print(e)
+    return get_credentials().whatsapp_page_id
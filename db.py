@@ -0,0 +1,84 @@
+import os
+import threading
+import pymongo
+import credential_manager as cm
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def _client_options() -> dict:
+    """
+    Returns the MongoClient pool and timeout options, overridable through environment variables.
+    """
+
+    return {
+        "maxPoolSize": int(os.environ.get("PLUSWORD_DB_MAX_POOL_SIZE", 10)),
+        "minPoolSize": int(os.environ.get("PLUSWORD_DB_MIN_POOL_SIZE", 0)),
+        "maxIdleTimeMS": int(os.environ.get("PLUSWORD_DB_MAX_IDLE_TIME_MS", 300000)),
+        "connectTimeoutMS": int(os.environ.get("PLUSWORD_DB_CONNECT_TIMEOUT_MS", 5000)),
+        "socketTimeoutMS": int(os.environ.get("PLUSWORD_DB_SOCKET_TIMEOUT_MS", 10000)),
+        "serverSelectionTimeoutMS": int(os.environ.get("PLUSWORD_DB_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+    }
+
+
+def get_client() -> pymongo.MongoClient:
+    """
+    Returns the process-wide MongoClient, creating it on first use.
+
+    The client is created lazily so that each gunicorn worker builds its own connection pool after fork.
+    MongoClient is not fork-safe, so a client inherited from a parent process is discarded and replaced.
+    """
+
+    global _client, _client_pid
+
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = pymongo.MongoClient(cm.get_db_connection_string(), **_client_options())
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_collection(database: str, collection: str):
+    """
+    Gets a collection object from the shared client.
+    Arguments:
+        database (str): name of the database on the MongoDB server to access
+        collection (str): name of the collection within the database to access
+    """
+
+    return get_client()[database][collection]
+
+
+def close_client():
+    """
+    Closes the shared client if this process created it.
+    """
+
+    global _client, _client_pid
+
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    """
+    Drops the reference to the parent's client in a forked child without closing the parent's sockets.
+    """
+
+    global _client, _client_pid, _lock
+
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
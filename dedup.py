@@ -0,0 +1,122 @@
+import datetime
+import logging
+import os
+import threading
+from pymongo.errors import BulkWriteError, PyMongoError
+import db as mongo
+import metrics
+from cache import TTLCache
+
+# Meta stops redelivering a webhook after about a day, keep message ids for a little longer than that
+DEDUP_TTL = int(os.environ.get("PLUSWORD_DEDUP_TTL", 2 * 24 * 60 * 60))
+DEDUP_CACHE_SIZE = int(os.environ.get("PLUSWORD_DEDUP_CACHE_SIZE", 4096))
+DUPLICATE_KEY_ERROR = 11000
+
+_local = TTLCache(maxsize=DEDUP_CACHE_SIZE, ttl=DEDUP_TTL)
+_lock = threading.Lock()
+_counters = {"messages": 0, "duplicates": 0, "duplicates_local": 0, "duplicates_stored": 0}
+
+
+def _count(*names: str):
+    with _lock:
+        for name in names:
+            _counters[name] += 1
+
+
+def get_collection():
+    """
+    Returns the shared ProcessedMessages collection. Entries expire through the TTL index created by schema.py.
+    """
+
+    return mongo.get_collection("PlusWord", "ProcessedMessages")
+
+
+def seen(message_id: str) -> bool:
+    """
+    Checks the in-process cache for a message that has already been taken on, without touching the database.
+    Counts every message checked, so call it once per delivery.
+
+    Arguments:
+        message_id (str): WhatsApp message id
+    """
+
+    _count("messages")
+    if message_id in _local:
+        _count("duplicates", "duplicates_local")
+        return True
+    return False
+
+
+def claim(message_ids: [str]) -> set:
+    """
+    Records a payload's messages as processed in the shared ProcessedMessages collection with a single insert_many.
+    Returns the ids another delivery, possibly on another worker, has already claimed. Ids that fail to insert for
+    any other reason are neither returned nor remembered, so they're handled now and a redelivery isn't dropped.
+    Errors other than write errors are raised.
+
+    Arguments:
+        message_ids ([str]): WhatsApp message ids
+    """
+
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return set()
+
+    now = datetime.datetime.now()
+    errors = {}
+    try:
+        get_collection().insert_many([{"_id": message_id, "created_at": now} for message_id in message_ids],
+                                     ordered=False)
+    except BulkWriteError as ex:
+        errors = {error["index"]: error for error in ex.details.get("writeErrors", [])}
+
+    duplicates = set()
+    for index, message_id in enumerate(message_ids):
+        error = errors.get(index)
+        if error is None:
+            _local.set(message_id, True)
+        elif error.get("code") == DUPLICATE_KEY_ERROR:
+            _local.set(message_id, True)
+            _count("duplicates", "duplicates_stored")
+            duplicates.add(message_id)
+        else:
+            logging.error(f"Could not claim message {message_id}: {error.get('errmsg')}")
+    return duplicates
+
+
+def release(message_ids: [str]):
+    """
+    Forgets claimed messages whose handling failed, in this process and in ProcessedMessages, so a redelivery is
+    handled again rather than dropped. Errors are logged rather than raised.
+
+    Arguments:
+        message_ids ([str]): WhatsApp message ids
+    """
+
+    message_ids = [message_id for message_id in dict.fromkeys(message_ids) if message_id]
+    if not message_ids:
+        return
+
+    for message_id in message_ids:
+        _local.pop(message_id)
+    try:
+        get_collection().delete_many({"_id": {"$in": message_ids}})
+    except PyMongoError as ex:
+        logging.error(f"Could not release messages {message_ids}: {ex}")
+
+
+def stats() -> dict:
+    """
+    Returns the de-duplication counters for this process and the share of messages that were duplicates.
+    """
+
+    with _lock:
+        counters = dict(_counters)
+    counters["duplicate_rate"] = counters["duplicates"] / counters["messages"] if counters["messages"] else 0.0
+    return counters
+
+
+metrics.gauge("plusword_dedup_messages_total", "Webhook messages checked for redelivery.",
+              lambda: _counters["messages"], kind="counter")
+metrics.gauge("plusword_dedup_duplicates_total", "Redelivered messages dropped.",
+              lambda: _counters["duplicates"], kind="counter")
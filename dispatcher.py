@@ -0,0 +1,162 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from urllib3.exceptions import NewConnectionError
+import db as mongo
+import graph_api
+import metrics
+
+DISPATCH_CONCURRENCY = int(os.environ.get("PLUSWORD_DISPATCH_CONCURRENCY", 8))
+# sustained messages per second and burst size, kept under the Graph API messaging throughput limit
+DISPATCH_RATE = float(os.environ.get("PLUSWORD_DISPATCH_RATE", 20))
+DISPATCH_BURST = int(os.environ.get("PLUSWORD_DISPATCH_BURST", 20))
+DISPATCH_ATTEMPTS = int(os.environ.get("PLUSWORD_DISPATCH_ATTEMPTS", 2))
+DISPATCH_BACKOFF = float(os.environ.get("PLUSWORD_DISPATCH_BACKOFF", 0.5))
+# seconds dispatch outcomes are kept for
+DISPATCH_HISTORY_TTL = int(os.environ.get("PLUSWORD_DISPATCH_HISTORY_TTL", 30 * 24 * 60 * 60))
+
+DISPATCHES = metrics.counter(
+    "plusword_dispatches_total",
+    "Dispatched messages by kind and outcome.",
+    ("kind", "status")
+)
+DISPATCH_LAG = metrics.histogram(
+    "plusword_dispatch_lag_seconds",
+    "Seconds between when a dispatched message was due and when it was sent.",
+    ("kind",),
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Attributes:
+        rate (float): tokens added per second
+        capacity (int): maximum number of tokens held, i.e. the largest burst allowed
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        Constructor for TokenBucket class.
+
+        Arguments:
+            rate (float): tokens added per second
+            capacity (int): maximum number of tokens held, i.e. the largest burst allowed
+        """
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, blocking until one is available.
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_bucket = TokenBucket(DISPATCH_RATE, DISPATCH_BURST)
+
+
+def _never_sent(ex: requests.RequestException) -> bool:
+    """
+    Checks whether a request failed before reaching Meta, i.e. the connection couldn't be made, so sending it again
+    can't deliver the message twice.
+    """
+
+    if isinstance(ex, requests.ConnectTimeout):
+        return True
+    reason = getattr(ex.args[0], "reason", None) if ex.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _send(phone_number: str, text: str, bucket: TokenBucket) -> dict:
+    """
+    Sends one message and returns the outcome for the recipient. The Graph API session already retries connect
+    errors and 429s a few times in quick succession. Sends that still couldn't connect are tried again here after a
+    longer backoff, to ride out a brief outage. Read timeouts and 5xx responses are never retried, as Meta may have
+    delivered the message.
+    """
+
+    outcome = {"phone_number": phone_number, "status": "failed", "attempts": 0, "status_code": None, "error": None}
+    for attempt in range(1, DISPATCH_ATTEMPTS + 1):
+        outcome["attempts"] = attempt
+        bucket.acquire()
+        try:
+            response = graph_api.send_text(phone_number, text)
+        except requests.RequestException as ex:
+            outcome["error"] = str(ex)
+            if not _never_sent(ex):
+                break
+            if attempt < DISPATCH_ATTEMPTS:
+                time.sleep(DISPATCH_BACKOFF * 2 ** (attempt - 1))
+            continue
+
+        outcome["status_code"] = response.status_code
+        if response.ok:
+            outcome["status"] = "sent"
+            outcome["error"] = None
+        else:
+            outcome["error"] = response.text[:500]
+        break
+
+    outcome["sent_at"] = datetime.datetime.now()
+    return outcome
+
+
+def dispatch(phone_numbers: [str], text: str, scheduled_for: datetime.datetime = None,
+             kind: str = "reminder", bucket: TokenBucket = None) -> [dict]:
+    """
+    Sends the same text to a batch of recipients concurrently over the pooled Graph API session, within the rate
+    limit. Records every recipient's outcome in the Dispatches collection and returns the outcomes.
+
+    Arguments:
+        phone_numbers ([str]): phone numbers of the recipients
+        text (str): text message body to be sent
+        scheduled_for (datetime): when the messages were due, used to record dispatch lag
+        kind (str): kind of message, recorded with each outcome
+        bucket (TokenBucket): rate limiter, defaults to the process-wide one
+    """
+
+    if not phone_numbers:
+        return []
+
+    bucket = bucket or _bucket
+    scheduled_for = scheduled_for or datetime.datetime.now()
+    with ThreadPoolExecutor(max_workers=min(DISPATCH_CONCURRENCY, len(phone_numbers))) as executor:
+        outcomes = list(executor.map(lambda phone_number: _send(phone_number, text, bucket), phone_numbers))
+
+    for outcome in outcomes:
+        outcome["kind"] = kind
+        outcome["scheduled_for"] = scheduled_for
+        outcome["lag_seconds"] = (outcome["sent_at"] - scheduled_for).total_seconds()
+        DISPATCHES.inc(kind=kind, status=outcome["status"])
+        DISPATCH_LAG.observe(max(outcome["lag_seconds"], 0), kind=kind)
+        if outcome["status"] != "sent":
+            logging.error(f"Failed to send {kind} to {outcome['phone_number']}: {outcome['error']}",
+                          extra={"phone_number": outcome["phone_number"]})
+
+    try:
+        mongo.get_collection("PlusWord", "Dispatches").insert_many([dict(outcome) for outcome in outcomes])
+    except Exception as ex:
+        logging.exception(f"Could not record dispatch outcomes: {ex}")
+
+    return outcomes
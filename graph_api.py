@@ -0,0 +1,164 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import credential_manager as cm
+import metrics
+
+GRAPH_API_URL = os.environ.get("PLUSWORD_GRAPH_API_URL", "https://graph.facebook.com/v21.0")
+TIMEOUT = (
+    float(os.environ.get("PLUSWORD_GRAPH_CONNECT_TIMEOUT", 3.05)),
+    float(os.environ.get("PLUSWORD_GRAPH_READ_TIMEOUT", 10)),
+)
+POOL_SIZE = int(os.environ.get("PLUSWORD_GRAPH_POOL_SIZE", 10))
+MAX_RETRIES = int(os.environ.get("PLUSWORD_GRAPH_MAX_RETRIES", 3))
+BACKOFF_FACTOR = float(os.environ.get("PLUSWORD_GRAPH_BACKOFF_FACTOR", 0.5))
+
+REQUESTS = metrics.counter(
+    "plusword_graph_requests_total",
+    "Graph API requests by endpoint and response status, error when no response was received.",
+    ("endpoint", "status")
+)
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """
+    Retries idempotent requests on read errors and error statuses, but sends only on connect errors, which are
+    retried for every method, and on 429. Meta may have accepted a send that timed out or failed with a 5xx, and
+    repeating it would deliver the message twice.
+    """
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session() -> requests.Session:
+    """
+    Builds a keep-alive session with a bounded connection pool and retry with exponential backoff.
+    """
+
+    retry = _Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide Graph API session, creating it on first use.
+    """
+
+    global _session, _session_pid
+
+    if _session is not None and _session_pid == os.getpid():
+        return _session
+
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _build_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def _auth_header() -> dict:
+    return {
+        "Authorization": f"Bearer {cm.get_whatsapp_key()}"
+    }
+
+
+def _request(endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Makes a request over the shared session, timing it and counting its status.
+
+    Arguments:
+        endpoint (str): name the request is recorded under, e.g. send_text
+        method (str): HTTP method
+        url (str): url to request
+        kwargs: passed on to the session
+    """
+
+    try:
+        with metrics.timed(f"graph_{endpoint}"):
+            response = get_session().request(method, url, headers=_auth_header(), timeout=TIMEOUT, **kwargs)
+    except requests.RequestException:
+        REQUESTS.inc(endpoint=endpoint, status="error")
+        raise
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    return response
+
+
+def send_text(phone_number: str, text: str) -> requests.Response:
+    """
+    Sends a WhatsApp text message.
+
+    Arguments:
+        phone_number (str): phone number of the recipient
+        text (str): text message body to be sent
+    """
+
+    body = {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": phone_number,
+        "type": "text",
+        "text": {
+            "preview_url": True,
+            "body": text
+        }
+    }
+    return _request("send_text", "POST", f"{GRAPH_API_URL}/{cm.get_whatsapp_page_id()}/messages", json=body)
+
+
+def get_media_url(media_id: str) -> str:
+    """
+    Returns the download url for a media attachment.
+
+    Arguments:
+        media_id (str): id of the media attachment in the received message
+    """
+
+    response = _request("media_url", "GET", f"{GRAPH_API_URL}/{media_id}")
+    response.raise_for_status()
+    return response.json().get("url")
+
+
+def download_media(media_id: str) -> bytes:
+    """
+    Downloads a media attachment and returns its raw bytes.
+
+    Arguments:
+        media_id (str): id of the media attachment in the received message
+    """
+
+    response = _request("media_download", "GET", get_media_url(media_id))
+    response.raise_for_status()
+    return response.content
+
+
+def _reset_after_fork():
+    global _session, _session_pid, _lock
+
+    _session = None
+    _session_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
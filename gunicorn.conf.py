@@ -0,0 +1,44 @@
+# Give the background work queue time to drain before a worker is killed.
+graceful_timeout = 30
+
+
+def on_starting(server):
+    """
+    Creates missing indexes and runs short pending migrations once, in the master process, before workers are
+    forked. Collection rebuilds are left to `python schema.py migrate`. A database that can't be reached is logged
+    and gunicorn starts serving anyway.
+    """
+    import logging
+    import log_config
+    import schema
+
+    log_config.configure("log.txt")
+    try:
+        schema.migrate(include_long=False)
+    except Exception as ex:
+        logging.exception(f"Could not create indexes and run migrations on startup: {ex}")
+
+
+def post_worker_init(worker):
+    """
+    Pre-warms the settings cache and the set of who has submitted today in each worker once it has been forked.
+    Both are caches, so a failure is logged and they're filled on first use instead.
+    """
+    import logging
+    import settings
+    import submitted
+
+    settings.start()
+    try:
+        submitted.seed()
+    except Exception as ex:
+        logging.warning(f"Could not seed today's submitters, seeding on first use instead: {ex}")
+
+
+def worker_exit(server, worker):
+    """
+    Drains the webhook work queue when a gunicorn worker shuts down.
+    """
+    from pluswordchatbot import work_queue
+
+    work_queue.shutdown(timeout=graceful_timeout)
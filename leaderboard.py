@@ -0,0 +1,228 @@
+import argparse
+import datetime
+import logging
+import os
+import pymongo
+from pymongo import ReturnDocument
+import credential_manager as cm
+import db as mongo
+from write_batch import run_callback
+
+LEADERBOARD_SIZE = int(os.environ.get("PLUSWORD_LEADERBOARD_SIZE", 10))
+BATCH_SIZE = 1000
+
+_SORT = {"seconds": pymongo.ASCENDING, "load_ts": pymongo.ASCENDING}
+
+
+def get_collection():
+    return mongo.get_collection("PlusWord", "DailyLeaderboard")
+
+
+def _entry(phone_number: str, user: str, seconds: int, time: str, load_ts: datetime.datetime) -> dict:
+    return {"phone_number": phone_number, "user": user, "seconds": seconds, "time": time, "load_ts": load_ts}
+
+
+def _rank(board: dict, phone_number: str, puzzle_date: str, seconds: int) -> int:
+    """
+    Returns the position of a user's time on a day's leaderboard. Times that didn't make the top of the board are
+    ranked with an indexed count of the faster times that day.
+    """
+
+    for position, entry in enumerate(board.get("entries", []), start=1):
+        if entry["phone_number"] == phone_number:
+            return position
+    return mongo.get_collection("PlusWord", "Times").count_documents(
+        {"puzzle_date": puzzle_date, "seconds": {"$lt": seconds}}
+    ) + 1
+
+
+def queue_submission(batch, puzzle_date: str, phone_number: str, user: str, seconds: int, time: str,
+                     load_ts: datetime.datetime, callback):
+    """
+    Queues a new submission on a write batch, adding it to its day's leaderboard and keeping only the fastest
+    LEADERBOARD_SIZE times. Once the batch is flushed, the boards of every submission in it are read back in one
+    query and callback is called with the (rank, submissions) the submission landed at.
+
+    Arguments:
+        batch (WriteBatch): write batch the update is queued on
+        puzzle_date (str): puzzle date the time counts towards, YYYY-MM-DD
+        phone_number (str): phone number of the user who submitted
+        user (str): username of the user who submitted
+        seconds (int): solve time in seconds
+        time (str): solve time as submitted
+        load_ts (datetime): when the puzzle was completed, used to break ties
+        callback: called as callback((rank, submissions))
+    """
+
+    batch.add("DailyLeaderboard", pymongo.UpdateOne(
+        {"_id": puzzle_date},
+        {
+            "$push": {"entries": {
+                "$each": [_entry(phone_number, user, seconds, time, load_ts)],
+                "$sort": _SORT,
+                "$slice": LEADERBOARD_SIZE,
+            }},
+            "$inc": {"submissions": 1},
+        },
+        upsert=True
+    ))
+    batch.after("leaderboard_placings", (puzzle_date, phone_number, seconds, callback), _send_placings)
+
+
+def _send_placings(submissions: list):
+    """
+    Reads back the boards of a batch of submissions in one query and hands each submission its placing.
+    """
+
+    boards = {
+        board["_id"]: board
+        for board in get_collection().find({"_id": {"$in": list({puzzle_date for puzzle_date, *_ in submissions})}})
+    }
+    for puzzle_date, phone_number, seconds, callback in submissions:
+        board = boards.get(puzzle_date, {"submissions": 1})
+        run_callback(callback, (_rank(board, phone_number, puzzle_date, seconds), board["submissions"]))
+
+
+def _literal(value):
+    # values are embedded in an update pipeline, where a string starting with $ would be read as a field path
+    return {"$literal": value} if isinstance(value, str) and value.startswith("$") else value
+
+
+def _refill(puzzle_date: str) -> dict:
+    """
+    Rebuilds a day's board from its fastest times in Times, read with the (puzzle_date, seconds) index, and returns
+    the board.
+    """
+
+    times = mongo.get_collection("PlusWord", "Times").find(
+        {"puzzle_date": puzzle_date, "seconds": {"$exists": True}},
+        {"phone_number": 1, "user": 1, "seconds": 1, "time": 1, "load_ts": 1}
+    ).sort(list(_SORT.items())).limit(LEADERBOARD_SIZE)
+    entries = [_entry(t["phone_number"], t.get("user"), t["seconds"], t.get("time"), t["load_ts"]) for t in times]
+    return get_collection().find_one_and_update(
+        {"_id": puzzle_date}, {"$set": {"entries": entries}}, return_document=ReturnDocument.AFTER
+    )
+
+
+def record_edit(puzzle_date: str, phone_number: str, user: str, seconds: int, time: str,
+                load_ts: datetime.datetime) -> (int, int):
+    """
+    Replaces a user's entry on a day's leaderboard after they edit their time, in a single update so readers never
+    see the board without them. The board only holds the fastest times, so when a time made slower drops to the last
+    place on a full board, a faster time that wasn't held on the board may belong there instead, and the board is
+    refilled from Times. Returns the rank the edited time landed at and the number of submissions that day.
+
+    Arguments:
+        puzzle_date (str): puzzle date of the edited time, YYYY-MM-DD
+        phone_number (str): phone number of the user who edited their time, as stored in Times
+        user (str): username of the user who edited their time
+        seconds (int): solve time in seconds after the edit
+        time (str): solve time as edited
+        load_ts (datetime): when the puzzle was completed, used to break ties
+    """
+
+    entry = {key: _literal(value) for key, value in _entry(phone_number, user, seconds, time, load_ts).items()}
+
+    def placed(before: str, tie: str) -> dict:
+        # entries on one side of the edited time, in the order _SORT keeps the board in
+        return {"$filter": {"input": "$$others", "as": "entry", "cond": {"$or": [
+            {before: ["$$entry.seconds", seconds]},
+            {"$and": [{"$eq": ["$$entry.seconds", seconds]}, {tie: ["$$entry.load_ts", load_ts]}]},
+        ]}}}
+
+    others = {"$filter": {
+        "input": {"$ifNull": ["$entries", []]},
+        "as": "entry",
+        "cond": {"$ne": ["$$entry.phone_number", phone_number]},
+    }}
+    board = get_collection().find_one_and_update(
+        {"_id": puzzle_date},
+        [{"$set": {
+            "entries": {"$let": {"vars": {"others": others}, "in": {"$slice": [
+                {"$concatArrays": [placed("$lt", "$lte"), [entry], placed("$gt", "$gt")]},
+                LEADERBOARD_SIZE
+            ]}}},
+            "submissions": {"$ifNull": ["$submissions", 1]},
+        }}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    entries = board["entries"]
+    if (board["submissions"] > LEADERBOARD_SIZE and len(entries) == LEADERBOARD_SIZE
+            and entries[-1]["phone_number"] == phone_number):
+        board = _refill(puzzle_date)
+    return _rank(board, phone_number, puzzle_date, seconds), board["submissions"]
+
+
+def get_leaderboard(puzzle_date: str):
+    """
+    Returns a day's leaderboard document, or None if nobody has submitted that day.
+
+    Arguments:
+        puzzle_date (str): puzzle date, YYYY-MM-DD
+    """
+
+    return get_collection().find_one({"_id": puzzle_date})
+
+
+def ordinal(number: int) -> str:
+    """
+    Returns a number with its ordinal suffix, e.g. 1st, 12th, 23rd.
+
+    Arguments:
+        number (int): number to format
+    """
+
+    suffix = "th" if 10 <= number % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+
+def rebuild(database=None):
+    """
+    Recomputes every day's leaderboard from Times in bulk.
+
+    Arguments:
+        database: PlusWord database to rebuild, defaults to the shared client's
+    """
+
+    database = database if database is not None else mongo.get_client()["PlusWord"]
+    cursor = database["Times"].aggregate([
+        {"$match": {"seconds": {"$exists": True}, "puzzle_date": {"$exists": True}}},
+        {"$sort": _SORT},
+        {"$group": {
+            "_id": "$puzzle_date",
+            "submissions": {"$sum": 1},
+            "entries": {"$push": {
+                "phone_number": "$phone_number",
+                "user": "$user",
+                "seconds": "$seconds",
+                "time": "$time",
+                "load_ts": "$load_ts",
+            }},
+        }},
+        {"$project": {"submissions": 1, "entries": {"$slice": ["$entries", LEADERBOARD_SIZE]}}},
+    ], allowDiskUse=True)
+
+    batch = []
+    for board in cursor:
+        batch.append(pymongo.ReplaceOne({"_id": board["_id"]}, board, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            database["DailyLeaderboard"].bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        database["DailyLeaderboard"].bulk_write(batch, ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the PlusWord daily leaderboards.")
+    parser.add_argument("action", choices=["rebuild"], help="rebuild: recompute every day's leaderboard from Times")
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cm.get_credentials()
+    rebuild()
+
+
+if __name__ == "__main__":
+    main()
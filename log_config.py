@@ -0,0 +1,261 @@
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+import metrics
+
+LOG_LEVEL = os.environ.get("PLUSWORD_LOG_LEVEL", "INFO").upper()
+# file logs are written to, "-" for stderr, defaults to the file each process has always written to
+LOG_FILE = os.environ.get("PLUSWORD_LOG_FILE")
+LOG_FORMAT = os.environ.get("PLUSWORD_LOG_FORMAT", "json")
+# share of records at or below PLUSWORD_LOG_SAMPLE_LEVEL that are kept, more severe records are always kept
+LOG_SAMPLE_RATE = float(os.environ.get("PLUSWORD_LOG_SAMPLE_RATE", 1))
+LOG_SAMPLE_LEVEL = os.environ.get("PLUSWORD_LOG_SAMPLE_LEVEL", "INFO").upper()
+LOG_REDACT = os.environ.get("PLUSWORD_LOG_REDACT", "true").lower() not in ("0", "false", "no")
+# records waiting to be written, once full new records are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = int(os.environ.get("PLUSWORD_LOG_QUEUE_SIZE", 10000))
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s %(message_id)s] %(message)s"
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_message_id = contextvars.ContextVar("message_id", default=None)
+# phone numbers masked wherever they appear in records logged in the current context
+_phone_numbers = contextvars.ContextVar("phone_numbers", default=())
+
+_handler = None
+_listener = None
+_pid = None
+_lock = threading.Lock()
+
+
+def redact(text: str, numbers) -> str:
+    """
+    Masks the given phone numbers wherever they appear in a string, keeping their last four digits so a user's
+    records can still be followed.
+
+    Arguments:
+        text (str): text to redact
+        numbers: phone numbers to mask
+    """
+
+    for number in numbers:
+        if number and len(number) > 4:
+            text = text.replace(number, "*" * (len(number) - 4) + number[-4:])
+    return text
+
+
+def _numbers(record: logging.LogRecord) -> list:
+    numbers = list(getattr(record, "phone_numbers", ()))
+    if number := getattr(record, "phone_number", None):
+        numbers.append(str(number))
+    return numbers
+
+
+@contextlib.contextmanager
+def context(request_id: str = None, message_id: str = None, phone_numbers=()):
+    """
+    Tags every record logged in the enclosed block, including from work queued by it, with request and message ids,
+    and masks the given phone numbers in them. Records logged about a single number elsewhere can pass it as
+    extra={"phone_number": number} instead.
+
+    Arguments:
+        request_id (str): id of the webhook request being handled
+        message_id (str): id of the WhatsApp message being handled
+        phone_numbers: phone numbers to mask, added to any masked by an enclosing block
+    """
+
+    tokens = []
+    if request_id is not None:
+        tokens.append((_request_id, _request_id.set(request_id)))
+    if message_id is not None:
+        tokens.append((_message_id, _message_id.set(message_id)))
+    if phone_numbers:
+        numbers = _phone_numbers.get() + tuple(str(number) for number in phone_numbers)
+        tokens.append((_phone_numbers, _phone_numbers.set(numbers)))
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the current request and message ids and the phone numbers to mask to records, on the logging thread before
+    they're queued.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        record.message_id = _message_id.get()
+        record.phone_numbers = _phone_numbers.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of records at or below a level, so chatty paths can be logged without flooding the output.
+
+    Attributes:
+        rate (float): share of records kept, between 0 and 1
+        level (int): most severe level sampled
+    """
+
+    def __init__(self, rate: float, level: int):
+        """
+        Constructor for SamplingFilter class.
+
+        Arguments:
+            rate (float): share of records kept, between 0 and 1
+            level (int): most severe level sampled
+        """
+
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > self.level or self.rate >= 1 or random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one line of JSON, with its phone numbers masked if PLUSWORD_LOG_REDACT is on.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for name in ("request_id", "message_id"):
+            if value := getattr(record, name, None):
+                entry[name] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        return redact(line, _numbers(record)) if LOG_REDACT else line
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formats a record as a line of text, with its phone numbers masked if PLUSWORD_LOG_REDACT is on.
+    """
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, defaults={"request_id": None, "message_id": None})
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        return redact(line, _numbers(record)) if LOG_REDACT else line
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Queues records for the listener thread without blocking, dropping them if the queue is full. Only the message
+    and traceback are rendered on the calling thread, formatting and writing happen on the listener.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _QueueHandler.dropped += 1
+
+
+def _output(filename: str) -> logging.Handler:
+    if filename in (None, "-"):
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.FileHandler(filename)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    return handler
+
+
+def configure(default_file: str = None):
+    """
+    Configures logging for the process, once. Records are queued by the logging thread and written by a background
+    listener thread, so logging never waits on I/O.
+
+    Arguments:
+        default_file (str): file logs are written to unless PLUSWORD_LOG_FILE is set, None for stderr
+    """
+
+    global _handler, _listener, _pid
+
+    with _lock:
+        if _pid == os.getpid():
+            return
+
+        _handler = _QueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE, logging.getLevelName(LOG_SAMPLE_LEVEL)))
+        _handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(LOG_LEVEL)
+
+        _listener = QueueListener(_handler.queue, _output(LOG_FILE or default_file), respect_handler_level=True)
+        _listener.start()
+        _pid = os.getpid()
+
+
+def stop():
+    """
+    Writes out every queued record and stops the listener thread.
+    """
+
+    global _pid
+
+    with _lock:
+        if _listener is not None and _pid == os.getpid():
+            _listener.stop()
+            _pid = None
+
+
+def _reset_after_fork():
+    global _listener, _pid, _lock
+
+    _lock = threading.Lock()
+    if _listener is None:
+        return
+    # the listener thread doesn't survive a fork and the queue's lock may have been held by it
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+    _pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(stop)
+metrics.gauge(
+    "plusword_log_dropped_total",
+    "Log records dropped because the log queue was full.",
+    lambda: _QueueHandler.dropped,
+    kind="counter"
+)
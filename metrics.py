@@ -0,0 +1,331 @@
+import bisect
+import contextlib
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# share of webhook payloads run under cProfile, 0 turns profiling off
+PROFILE_SAMPLE_RATE = float(os.environ.get("PLUSWORD_PROFILE_SAMPLE_RATE", 0))
+# profiled payloads slower than this many seconds are saved to PROFILE_DIR
+PROFILE_SLOW_SECONDS = float(os.environ.get("PLUSWORD_PROFILE_SLOW_SECONDS", 1))
+PROFILE_DIR = os.environ.get("PLUSWORD_PROFILE_DIR", "profiles")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by labels.
+
+    Attributes:
+        name (str): metric name
+        help (str): description shown in the exposition
+        labels (tuple): label names, values are passed to inc() as keyword arguments
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        """
+        Constructor for Counter class.
+
+        Arguments:
+            name (str): metric name
+            help (str): description shown in the exposition
+            labels (tuple): label names
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Adds to the counter.
+
+        Arguments:
+            amount (float): amount to add
+            labels: a value for each of the counter's labels
+        """
+
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> [str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, optionally split by labels.
+
+    Attributes:
+        name (str): metric name
+        help (str): description shown in the exposition
+        labels (tuple): label names, values are passed to observe() as keyword arguments
+        buckets (tuple): upper bounds of the buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Constructor for Histogram class.
+
+        Arguments:
+            name (str): metric name
+            help (str): description shown in the exposition
+            labels (tuple): label names
+            buckets (tuple): upper bounds of the buckets
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Records a value.
+
+        Arguments:
+            value (float): value observed, e.g. a duration in seconds
+            labels: a value for each of the histogram's labels
+        """
+
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> [str]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket = _labels(self.labels, key, 'le="' + str(bound) + '"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            cumulative += counts[-1]
+            infinity = _labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{infinity} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Value read from a callback each time metrics are rendered, e.g. a queue length.
+
+    Attributes:
+        name (str): metric name
+        help (str): description shown in the exposition
+        kind (str): exposition type, gauge or counter for totals kept elsewhere
+    """
+
+    def __init__(self, name: str, help: str, read, kind: str = "gauge"):
+        """
+        Constructor for Gauge class.
+
+        Arguments:
+            name (str): metric name
+            help (str): description shown in the exposition
+            read: callable returning the current value
+            kind (str): exposition type, gauge or counter for totals kept elsewhere
+        """
+
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._read = read
+
+    def samples(self) -> [str]:
+        try:
+            return [f"{self.name} {self._read()}"]
+        except Exception as ex:
+            logging.warning(f"Could not read {self.name}: {ex}")
+            return []
+
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    """
+    Returns the counter registered under a name, registering it on first use.
+
+    Arguments:
+        name (str): metric name
+        help (str): description shown in the exposition
+        labels (tuple): label names
+    """
+
+    return _register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """
+    Returns the histogram registered under a name, registering it on first use.
+
+    Arguments:
+        name (str): metric name
+        help (str): description shown in the exposition
+        labels (tuple): label names
+        buckets (tuple): upper bounds of the buckets
+    """
+
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name: str, help: str, read, kind: str = "gauge") -> Gauge:
+    """
+    Registers a value read from a callback when metrics are rendered, replacing any registered under the same name.
+
+    Arguments:
+        name (str): metric name
+        help (str): description shown in the exposition
+        read: callable returning the current value
+        kind (str): exposition type, gauge or counter for totals kept elsewhere
+    """
+
+    metric = Gauge(name, help, read, kind)
+    with _lock:
+        _metrics[name] = metric
+    return metric
+
+
+STAGE_SECONDS = histogram("plusword_stage_seconds", "Time spent in each stage of handling a message.", ("stage",))
+
+
+@contextlib.contextmanager
+def timed(stage: str, metric: Histogram = STAGE_SECONDS, **labels):
+    """
+    Times the enclosed block into a histogram, by default the per-stage one.
+
+    Arguments:
+        stage (str): name of the stage, e.g. ocr or graph_send, only recorded by the per-stage histogram
+        metric (Histogram): histogram to record into
+        labels: values for any other labels of the histogram
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metric is STAGE_SECONDS:
+            labels["stage"] = stage
+        metric.observe(time.perf_counter() - started, **labels)
+
+
+@contextlib.contextmanager
+def profiled(name: str):
+    """
+    Runs the enclosed block under cProfile for a sample of calls, saving the profile if the block was slow.
+
+    Arguments:
+        name (str): name the profile is saved under
+    """
+
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is already active on this thread
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        elapsed = time.perf_counter() - started
+        if elapsed >= PROFILE_SLOW_SECONDS:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            profile.dump_stats(path)
+            logging.info(f"Saved profile of a {elapsed:.2f}s {name} to {path}.")
+
+
+def render() -> str:
+    """
+    Returns every registered metric in the Prometheus text exposition format.
+    """
+
+    with _lock:
+        metrics = list(_metrics.values())
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves /metrics from a background thread, for processes without a web app such as the reminder scheduler.
+
+    Arguments:
+        port (int): port to listen on
+        host (str): address to listen on
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,129 @@
+import io
+import re
+from PIL import Image
+import metrics
+import ocr_backends
+
+UPSCALE_FACTOR = 2
+
+# width the screenshot is shrunk to for the cheap pass that finds the completion banner
+LOCATE_WIDTH = 720
+# how far below the banner, in banner line heights, the solve time is looked for
+BAND_LINE_HEIGHTS = 4
+BAND_PSM = 7
+BAND_WHITELIST = "0123456789:"
+
+TIME_PATTERN = re.compile(r"(\d+:)?[0-5][0-9]:[0-5][0-9]")
+FULL_PAGE_PATTERN = re.compile(r"(?<=You completed today's PlusWord in\n\n)((\d+:)?[0-5][0-9]:[0-5][0-9])")
+
+
+def decode_image(data: bytes) -> Image.Image:
+    """
+    Decodes downloaded image bytes in memory.
+
+    Arguments:
+        data (bytes): raw image bytes as downloaded from the graph api
+    """
+
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def upscale(image: Image.Image) -> Image.Image:
+    """
+    Upscales an image for OCR.
+
+    Arguments:
+        image: PIL image to upscale
+    """
+
+    return image.resize((image.width * UPSCALE_FACTOR, image.height * UPSCALE_FACTOR), resample=Image.BOX)
+
+
+def locate_banner(image: Image.Image):
+    """
+    Finds the "You completed today's PlusWord in" banner with a fast OCR pass over a downscaled greyscale copy.
+    Returns the banner bounding box as (left, top, right, bottom) in the coordinates of the original image, or None
+    if no banner was found.
+
+    Arguments:
+        image: PIL image of the screenshot
+    """
+
+    scale = min(1.0, LOCATE_WIDTH / image.width)
+    small = image.convert("L")
+    if scale < 1.0:
+        small = small.resize((round(image.width * scale), round(image.height * scale)), resample=Image.BOX)
+
+    lines = ocr_backends.get_backend().image_to_lines(small)
+
+    for index, (text, box) in enumerate(lines):
+        text = text.lower()
+        if "completed" not in text:
+            continue
+        # narrow screens wrap the banner, so pull in the "PlusWord in" line that follows
+        if "plusword" not in text and index + 1 < len(lines):
+            following = lines[index + 1][1]
+            box = (min(box[0], following[0]), box[1], max(box[2], following[2]), following[3])
+        return tuple(round(coordinate / scale) for coordinate in box)
+
+    return None
+
+
+def read_time_from_band(image: Image.Image, banner: tuple):
+    """
+    Runs full resolution, single line OCR over the band just below the banner, where the solve time is shown.
+
+    Arguments:
+        image: PIL image of the screenshot
+        banner (tuple): banner bounding box as returned by locate_banner
+    """
+
+    _, top, _, bottom = banner
+    line_height = max(bottom - top, 1)
+    band = image.crop((0, bottom, image.width, min(image.height, bottom + line_height * BAND_LINE_HEIGHTS)))
+    if band.height <= 0:
+        return None
+
+    text = ocr_backends.get_backend().image_to_string(
+        upscale(band.convert("L")),
+        psm=BAND_PSM,
+        whitelist=BAND_WHITELIST
+    )
+    match = TIME_PATTERN.search(text)
+    return match.group() if match else None
+
+
+def read_time_from_image(image: Image.Image):
+    """
+    Extracts the solve time from a decoded PlusWord completion screenshot.
+    Only the band below the completion banner is recognised at full resolution, with a full page pass as a fallback.
+    Returns the time string, or None if no time was found.
+
+    Arguments:
+        image: PIL image of the screenshot
+    """
+
+    with metrics.timed("ocr_locate"):
+        banner = locate_banner(image)
+    if banner:
+        with metrics.timed("ocr_band"):
+            time = read_time_from_band(image, banner)
+        if time:
+            return time
+
+    with metrics.timed("ocr_full_page"):
+        text = ocr_backends.get_backend().image_to_string(upscale(image))
+    match = FULL_PAGE_PATTERN.search(text)
+    return match.group() if match else None
+
+
+def read_time(data: bytes):
+    """
+    Extracts the solve time from PlusWord completion screenshot bytes without writing anything to disk.
+    Returns the time string, or None if no time was found.
+
+    Arguments:
+        data (bytes): raw image bytes as downloaded from the graph api
+    """
+
+    return read_time_from_image(decode_image(data))
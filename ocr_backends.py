@@ -0,0 +1,198 @@
+import logging
+import os
+import queue
+import threading
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_BACKEND = os.environ.get("PLUSWORD_OCR_BACKEND", "auto")
+OCR_POOL_SIZE = int(os.environ.get("PLUSWORD_OCR_POOL_SIZE", os.environ.get("PLUSWORD_WORKERS", 4)))
+
+DEFAULT_PSM = 3
+
+
+class PytesseractBackend:
+    """
+    OCR backend that runs the tesseract binary through pytesseract. Spawns a process per call, kept as a fallback for
+    when tesserocr is not installed.
+    """
+
+    name = "pytesseract"
+
+    def image_to_string(self, image: Image.Image, psm: int = DEFAULT_PSM, whitelist: str = None) -> str:
+        """
+        Returns the text recognised in an image.
+
+        Arguments:
+            image: PIL image to recognise
+            psm (int): tesseract page segmentation mode
+            whitelist (str): characters to restrict recognition to, or None for no restriction
+        """
+
+        config = f"--psm {psm}"
+        if whitelist:
+            config += f" -c tessedit_char_whitelist={whitelist}"
+        return pytesseract.image_to_string(image, config=config)
+
+    def image_to_lines(self, image: Image.Image) -> [(str, tuple)]:
+        """
+        Returns the text lines recognised in an image as (text, (left, top, right, bottom)) tuples in reading order.
+
+        Arguments:
+            image: PIL image to recognise
+        """
+
+        data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+
+        lines = {}
+        for i, word in enumerate(data["text"]):
+            if not word.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            box = (data["left"][i], data["top"][i],
+                   data["left"][i] + data["width"][i], data["top"][i] + data["height"][i])
+            if key in lines:
+                words, line_box = lines[key]
+                words.append(word)
+                lines[key] = (words, (min(line_box[0], box[0]), min(line_box[1], box[1]),
+                                      max(line_box[2], box[2]), max(line_box[3], box[3])))
+            else:
+                lines[key] = ([word], box)
+
+        return [(" ".join(lines[key][0]), lines[key][1]) for key in sorted(lines)]
+
+
+class TesserocrBackend:
+    """
+    OCR backend that drives the tesseract C API in-process through tesserocr. Engines are kept warm in a bounded pool
+    so language data is loaded once per engine rather than once per image.
+
+    Attributes:
+        size (int): maximum number of engines in the pool
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, size: int = OCR_POOL_SIZE):
+        """
+        Constructor for TesserocrBackend class.
+
+        Arguments:
+            size (int): maximum number of engines in the pool
+        """
+
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed.")
+
+        self.size = max(size, 1)
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # load one engine up front so a broken install fails here rather than on the first submission
+        self._pool.put(self._create_engine())
+
+    def _create_engine(self):
+        engine = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.AUTO)
+        self._created += 1
+        return engine
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # engines are not fork-safe, start a fresh pool in a forked child
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pool = queue.LifoQueue()
+                    self._created = 0
+                    self._pid = os.getpid()
+
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                return self._create_engine()
+        return self._pool.get()
+
+    def _release(self, engine):
+        engine.Clear()
+        self._pool.put(engine)
+
+    def image_to_string(self, image: Image.Image, psm: int = DEFAULT_PSM, whitelist: str = None) -> str:
+        """
+        Returns the text recognised in an image.
+
+        Arguments:
+            image: PIL image to recognise
+            psm (int): tesseract page segmentation mode
+            whitelist (str): characters to restrict recognition to, or None for no restriction
+        """
+
+        engine = self._acquire()
+        try:
+            engine.SetPageSegMode(psm)
+            engine.SetVariable("tessedit_char_whitelist", whitelist or "")
+            engine.SetImage(image)
+            return engine.GetUTF8Text()
+        finally:
+            self._release(engine)
+
+    def image_to_lines(self, image: Image.Image) -> [(str, tuple)]:
+        """
+        Returns the text lines recognised in an image as (text, (left, top, right, bottom)) tuples in reading order.
+
+        Arguments:
+            image: PIL image to recognise
+        """
+
+        engine = self._acquire()
+        try:
+            engine.SetPageSegMode(DEFAULT_PSM)
+            engine.SetVariable("tessedit_char_whitelist", "")
+            engine.SetImage(image)
+            engine.Recognize()
+
+            lines = []
+            level = tesserocr.RIL.TEXTLINE
+            for result in tesserocr.iterate_level(engine.GetIterator(), level):
+                text = result.GetUTF8Text(level)
+                box = result.BoundingBox(level)
+                if text and text.strip() and box:
+                    lines.append((text.strip(), tuple(box)))
+            return lines
+        finally:
+            self._release(engine)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the configured OCR backend. PLUSWORD_OCR_BACKEND selects "tesserocr" or "pytesseract", "auto" uses
+    tesserocr when it is installed and falls back to pytesseract otherwise.
+    """
+
+    global _backend
+
+    if _backend is not None:
+        return _backend
+
+    with _backend_lock:
+        if _backend is None:
+            if OCR_BACKEND in ("auto", "tesserocr") and tesserocr is not None:
+                try:
+                    _backend = TesserocrBackend()
+                except Exception as ex:
+                    logging.exception(f"Could not start tesserocr, falling back to pytesseract: {ex}")
+            if _backend is None:
+                _backend = PytesseractBackend()
+        return _backend
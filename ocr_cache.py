@@ -0,0 +1,205 @@
+import datetime
+import hashlib
+import os
+import pymongo
+from PIL import Image
+import db as mongo
+import metrics
+import ocr
+from cache import TTLCache
+
+OCR_CACHE_TTL = int(os.environ.get("PLUSWORD_OCR_CACHE_TTL", 2 * 24 * 60 * 60))
+OCR_CACHE_SIZE = int(os.environ.get("PLUSWORD_OCR_CACHE_SIZE", 1024))
+# most grid cells a screenshot may differ in from a cached one and still be taken as a copy of it. On test
+# screenshots, re-encoding flipped up to 4 cells while changing one digit of the time flipped 9 or more
+PHASH_DISTANCE = int(os.environ.get("PLUSWORD_OCR_PHASH_DISTANCE", 4))
+# most recently cached screenshots of the same shape compared against on a miss
+PHASH_CANDIDATES = int(os.environ.get("PLUSWORD_OCR_PHASH_CANDIDATES", 200))
+
+_local = TTLCache(maxsize=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL)
+LOOKUPS = metrics.counter(
+    "plusword_ocr_cache_total",
+    "Screenshot lookups by how they were answered: media id, content or similar hit, or a miss that ran OCR.",
+    ("result",)
+)
+
+
+# screenshots of the same day's puzzle differ only in the time digits, so the hash grid has to be fine enough to
+# resolve them; an 8x8 dhash maps every user's screenshot to the same key
+PHASH_WIDTH = 128
+PHASH_THRESHOLD = 128
+
+
+def perceptual_hash(image: Image.Image, width: int = PHASH_WIDTH) -> tuple:
+    """
+    Returns a perceptual hash of an image as (shape, bits): the image is shrunk to a fixed width grid and thresholded
+    to black and white, one bit per cell. Copies of a screenshot re-encoded by WhatsApp differ from it in a few bits,
+    while screenshots with different times differ in more.
+
+    Arguments:
+        image: PIL image to hash
+        width (int): width of the grid the image is shrunk to
+    """
+
+    height = max(round(image.height * width / image.width), 1)
+    grid = image.convert("L").resize((width, height), resample=Image.BOX)
+    bits = grid.point(lambda pixel: 255 if pixel >= PHASH_THRESHOLD else 0).convert("1").tobytes()
+    return f"{width}x{height}", bits
+
+
+def hamming(bits: bytes, other: bytes) -> int:
+    """
+    Returns the number of bits two perceptual hashes of the same shape differ in.
+
+    Arguments:
+        bits (bytes): bits of a perceptual hash
+        other (bytes): bits of a perceptual hash of the same shape
+    """
+
+    return (int.from_bytes(bits, "big") ^ int.from_bytes(other, "big")).bit_count()
+
+
+def hash_key(image_hash: tuple) -> str:
+    """
+    Returns the cache key of a perceptual hash, which matches exact copies only.
+
+    Arguments:
+        image_hash (tuple): (shape, bits) as returned by perceptual_hash
+    """
+
+    shape, bits = image_hash
+    return f"phash:{shape}:{hashlib.sha1(bits).hexdigest()}"
+
+
+def get_collection():
+    """
+    Returns the shared OcrCache collection. Entries expire through the TTL index created by schema.py.
+    """
+
+    return mongo.get_collection("PlusWord", "OcrCache")
+
+
+def get(*keys):
+    """
+    Returns the cached time for the first key found in the in-process cache or the shared Mongo cache, or None.
+
+    Arguments:
+        keys: cache keys to look up, such as "media:<id>" or "sha256:<digest>"
+    """
+
+    for key in keys:
+        if (time := _local.get(key)) is not None:
+            return time
+
+    if document := get_collection().find_one({"_id": {"$in": list(keys)}}):
+        for key in keys:
+            _local.set(key, document["time"])
+        return document["time"]
+
+    return None
+
+
+def put(time: str, *keys):
+    """
+    Caches a time under each key, both in process and in Mongo so every worker shares it.
+
+    Arguments:
+        time (str): time extracted from the screenshot
+        keys: cache keys to store the time under
+    """
+
+    now = datetime.datetime.now()
+    for key in keys:
+        _local.set(key, time)
+    get_collection().bulk_write([
+        pymongo.UpdateOne({"_id": key}, {"$set": {"time": time, "created_at": now}}, upsert=True)
+        for key in keys
+    ], ordered=False)
+
+
+def find_similar(image_hash: tuple, distance: int = PHASH_DISTANCE):
+    """
+    Returns the cached time of the closest of the recently cached screenshots with the same shape whose perceptual
+    hash differs in at most distance bits, or None.
+
+    Arguments:
+        image_hash (tuple): (shape, bits) as returned by perceptual_hash
+        distance (int): most bits the hashes may differ in
+    """
+
+    shape, bits = image_hash
+    candidates = get_collection().find(
+        {"phash_shape": shape}, {"time": True, "phash": True}
+    ).sort("created_at", pymongo.DESCENDING).limit(PHASH_CANDIDATES)
+
+    closest = None
+    for candidate in candidates:
+        if len(candidate["phash"]) != len(bits):
+            continue
+        difference = hamming(bits, candidate["phash"])
+        if difference <= distance and (closest is None or difference < closest[0]):
+            closest = (difference, candidate["time"])
+    return closest[1] if closest else None
+
+
+def put_hash(time: str, image_hash: tuple):
+    """
+    Caches a time under a screenshot's perceptual hash, storing its bits so similar screenshots can be matched.
+
+    Arguments:
+        time (str): time extracted from the screenshot
+        image_hash (tuple): (shape, bits) as returned by perceptual_hash
+    """
+
+    shape, bits = image_hash
+    key = hash_key(image_hash)
+    _local.set(key, time)
+    get_collection().update_one(
+        {"_id": key},
+        {"$set": {"time": time, "phash_shape": shape, "phash": bits, "created_at": datetime.datetime.now()}},
+        upsert=True
+    )
+
+
+def read_time(media_id: str, fetch):
+    """
+    Returns the time from a screenshot, skipping the download when the media id has been seen before and skipping
+    OCR when the same bytes, or a screenshot with a close enough perceptual hash, have already been read.
+    Returns None if no time was found.
+
+    Arguments:
+        media_id (str): id of the image attachment in the received message
+        fetch: callable that downloads the image bytes for a media id
+    """
+
+    media_key = f"media:{media_id}"
+    if (time := get(media_key)) is not None:
+        LOOKUPS.inc(result="media")
+        return time
+
+    with metrics.timed("media_fetch"):
+        data = fetch(media_id)
+    digest_key = f"sha256:{hashlib.sha256(data).hexdigest()}"
+    with metrics.timed("decode"):
+        image = ocr.decode_image(data)
+    with metrics.timed("phash"):
+        image_hash = perceptual_hash(image)
+    if (time := get(digest_key, hash_key(image_hash))) is not None:
+        LOOKUPS.inc(result="content")
+        put(time, media_key, digest_key)
+        return time
+
+    with metrics.timed("phash_match"):
+        time = find_similar(image_hash)
+    if time is not None:
+        LOOKUPS.inc(result="similar")
+        put(time, media_key, digest_key)
+        return time
+
+    LOOKUPS.inc(result="miss")
+    with metrics.timed("ocr"):
+        time = ocr.read_time_from_image(image)
+    if time is not None:
+        put(time, media_key, digest_key)
+        put_hash(time, image_hash)
+    return time
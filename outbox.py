@@ -0,0 +1,73 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import graph_api
+
+# WhatsApp rejects text message bodies longer than this
+MAX_TEXT_LENGTH = 4096
+SEPARATOR = "\n\n"
+
+
+def merge(texts: [str], limit: int = MAX_TEXT_LENGTH) -> [str]:
+    """
+    Merges texts into as few message bodies as fit within the length limit, keeping their order.
+
+    Arguments:
+        texts ([str]): text message bodies to merge
+        limit (int): maximum length of a merged body
+    """
+
+    bodies = []
+    for text in texts:
+        if bodies and len(bodies[-1]) + len(SEPARATOR) + len(text) <= limit:
+            bodies[-1] += SEPARATOR + text
+        else:
+            bodies.append(text)
+    return bodies
+
+
+class Outbox:
+    """
+    Buffers the replies produced while a webhook payload is handled, so each recipient gets their replies merged
+    into one message sent when the payload is done, rather than one blocking send per reply.
+    """
+
+    def __init__(self):
+        """
+        Constructor for Outbox class.
+        """
+
+        self._replies = {}
+
+    def add(self, phone_number: str, text: str):
+        """
+        Queues a reply.
+
+        Arguments:
+            phone_number (str): phone number of the recipient
+            text (str): text message body to be sent
+        """
+
+        self._replies.setdefault(phone_number, []).append(text)
+
+    def flush(self):
+        """
+        Sends every queued reply, merged per recipient, with recipients sent to concurrently over the pooled Graph API
+        session.
+        """
+
+        replies, self._replies = self._replies, {}
+        if not replies:
+            return
+
+        sends = [(contextvars.copy_context(), item) for item in replies.items()]
+        with ThreadPoolExecutor(max_workers=min(len(replies), graph_api.POOL_SIZE)) as executor:
+            executor.map(lambda send: send[0].run(_send, *send[1]), sends)
+
+
+def _send(phone_number: str, texts: [str]):
+    for body in merge(texts):
+        try:
+            graph_api.send_text(phone_number, body)
+        except Exception as ex:
+            logging.exception(f"Failed to send reply to {phone_number}: {ex}", extra={"phone_number": phone_number})
@@ -1,14 +1,90 @@
+import atexit
 import logging
+import os
 import random
-import cv2
-import pytesseract
 from flask import Flask, request
-import pymongo
+from pymongo import UpdateOne
 import re
 import datetime
-import requests
+import uuid
 import credential_manager as cm
-from PIL import Image
+import db as mongo
+import dedup
+import graph_api
+import leaderboard
+import log_config
+import metrics
+import ocr_cache
+import settings
+import solve_time
+import stats
+import submitted
+from router import CommandRouter
+from outbox import Outbox
+from work_queue import WorkQueue
+from write_batch import WriteBatch
+
+QUEUE_SUBMIT_TIMEOUT = float(os.environ.get("PLUSWORD_QUEUE_SUBMIT_TIMEOUT", 0.05))
+
+TIME_PATTERN = re.compile(r"((\d+:)?[0-5][0-9]:[0-5][0-9])")
+REMINDER_OPTION_PATTERN = re.compile(r"^!reminder ([A-z]+)")
+REMINDER_TIME_PATTERN = re.compile(r"^!reminder [A-z]+ ((?:[0-1]?[0-9]|2[0-3]):[0-5][0-9])")
+RETRO_PATTERN = re.compile(r"([0-9]{2}-[0-9]{2}-[0-9]{4}:[0-9]{2}:[0-9]{2}) ((\d+:)?[0-5][0-9]:[0-5][0-9])")
+MOTIVATION_OPTION_PATTERN = re.compile(r"^!motivation ([A-z]+)")
+MOTIVATION_TIME_PATTERN = re.compile(r"^!motivation [A-z]+ ((\d+:)?[0-5][0-9]:[0-5][0-9])")
+LEADERBOARD_DATE_PATTERN = re.compile(r"^!leaderboard ([0-9]{2}-[0-9]{2}-[0-9]{4})")
+DEFAULT_MINIMUM_TIME = "01:00"
+DUPLICATE_KEY_ERROR = 11000
+
+router = CommandRouter()
+
+WEBHOOK_REQUESTS = metrics.counter(
+    "plusword_webhook_requests_total",
+    "Webhook deliveries by how they were answered: queued, redelivery, ignored or rejected with a 503.",
+    ("result",)
+)
+COMMAND_SECONDS = metrics.histogram(
+    "plusword_command_seconds",
+    "Time taken by each message's handler, by command, excluding the batched writes and replies.",
+    ("command",)
+)
+
+
+def puzzle_date(load_ts: datetime.datetime) -> str:
+    """
+    Returns the puzzle date key, YYYY-MM-DD, that a submission made at load_ts counts towards.
+
+    Arguments:
+        load_ts (datetime): when the puzzle was completed
+    """
+
+    return load_ts.date().isoformat()
+
+
+def format_placing(rank: int, submissions: int, day: str) -> str:
+    """
+    Returns a sentence describing where a time placed on the day's leaderboard.
+
+    Arguments:
+        rank (int): position of the time on the leaderboard
+        submissions (int): number of times submitted that day
+        day (str): how to refer to the day, e.g. "today"
+    """
+
+    return f"You're {leaderboard.ordinal(rank)} of {submissions} {day}."
+
+
+def format_best_date(user_stats: dict) -> str:
+    """
+    Returns " (DD-MM-YYYY)" for the day a user set their personal best, or an empty string if it isn't known.
+
+    Arguments:
+        user_stats (dict): the user's stats document
+    """
+
+    if not user_stats.get("best_date"):
+        return ""
+    return f" ({datetime.date.fromisoformat(user_stats['best_date']).strftime('%d-%m-%Y')})"
 
 
 class Bot:
@@ -17,7 +93,9 @@ class Bot:
     Contains methods for processing the data and responding to users via WhatsApp messages.
 
     Attributes:
-        client: pymongo client for accessing MongoDB
+        client: shared pymongo client for accessing MongoDB
+        batch (WriteBatch): write batch the payload's DB writes are queued on
+        outbox (Outbox): buffer the payload's replies are queued on
         type (str): message type for received message
         msg_from (str): username of user who sent received message
         number (str): phone number of user who sent received message
@@ -25,142 +103,85 @@ class Bot:
         msg_text (str): text contained in the received message
     """
 
-    def __init__(self, json_in):
+    def __init__(self, message: dict, contact: dict, batch: WriteBatch, outbox: Outbox):
         """
         Constructor for Bot class.
 
         Arguments:
-            json_in: incoming json received from webhook containing message data
+            message (dict): one message from the webhook payload
+            contact (dict): the payload's contact entry for the message's sender
+            batch (WriteBatch): write batch the payload's DB writes are queued on
+            outbox (Outbox): buffer the payload's replies are queued on
         """
 
-        value = json_in.get("entry")[0].get("changes")[0].get("value")
-        self.client = pymongo.MongoClient(cm.get_db_connection_string())
-        self.type = value.get("messages")[0].get("type")
-        self.msg_from = value.get("contacts")[0].get("profile").get("name")
-        self.number = value.get("contacts")[0].get("wa_id")
+        self.client = mongo.get_client()
+        self.batch = batch
+        self.outbox = outbox
+        self.type = message.get("type")
+        self.msg_from = contact.get("profile", {}).get("name")
+        self.number = contact.get("wa_id") or message.get("from")
+        self.img_id = None
+        self.msg_text = None
         if self.type == "image":
-            self.img_id = value.get("messages")[0].get("image").get("id")
+            self.img_id = message.get("image").get("id")
         elif self.type == "text":
-            self.msg_text = value.get("messages")[0].get("text").get("body")
+            self.msg_text = message.get("text").get("body")
 
     def send_text(self, text: str):
         """
-        Sends a text to the user from which the initial message was received.
+        Queues a text to the user from which the initial message was received. Replies are merged and sent once the
+        whole payload has been handled.
         Arguments:
             text (str): text message body to be sent
         """
 
-        print(f"Sending text to {self.number}: {text}")
-
-        header = {
-            "Authorization": f"Bearer {cm.get_whatsapp_key()}"
-        }
-
-        url = f"https://graph.facebook.com/v21.0/{cm.get_whatsapp_page_id()}/messages"
-
-        body = {
-            "messaging_product": "whatsapp",
-            "recipient_type": "individual",
-            "to": self.number,
-            "type": "text",
-            "text": {
-                "preview_url": True,
-                "body": text
-            }
-        }
-        requests.post(url=url, json=body, headers=header)
+        logging.debug(f"Queued reply to {self.number}: {text}", extra={"phone_number": self.number})
+        self.outbox.add(self.number, text)
 
+    @router.image
     def store_time_from_image(self):
         """
-        Saves the image data from graph api to be read by pytesseract and stored in db.
+        Reads the time from the image data from graph api, using the OCR cache where possible, and stores it in db.
         """
 
-        header = {
-            "Authorization": f"Bearer {cm.get_whatsapp_key()}"
-        }
-
-        print("Getting whatsapp reponse")
-        response = requests.get(url=f"https://graph.facebook.com/v21.0/{self.img_id}", headers=header)
-        print("Got whatsapp response", response.content)
-
-        img_url = response.json().get("url")
-
-        image = requests.get(url=img_url, headers=header).content
-
-        with open('submission.jpg', 'wb') as handler:
-            handler.write(image)
-
-        image = Image.open("submission.jpg")
-        upscaled_image = image.resize((image.width * 2, image.height * 2), resample=Image.BOX)
-        upscaled_image.save("submission.jpg")
-
-        img = cv2.imread('submission.jpg')
-        text = pytesseract.image_to_string(img)
-
-        db = self.get_db_collection("PlusWord", "Times")
-
-        today_date = datetime.date.today()
-        today_start = datetime.datetime(today_date.year, today_date.month, today_date.day)
-
-        print("Checking db")
-        if db.find_one({"phone_number": self.number, "load_ts": {'$gte': today_start}}):
-            self.send_text(f"You have already submitted a time for today. Use !edit to change your time.")
+        if submitted.has_submitted(self.number):
+            # skip the download and OCR for a time that can't be stored
+            self.reply_to_submission(None, None)
             return
 
-        time = re.search(r"(?<=You completed today's PlusWord in\n\n)((\d+:)?[0-5][0-9]:[0-5][0-9])", text)
+        time = ocr_cache.read_time(self.img_id, graph_api.download_media)
 
         if time:
-            time = time.group()
-            data = {
-                "user": self.msg_from,
-                "phone_number": self.number,
-                "time": time,
-                "load_ts": datetime.datetime.now()
-            }
-            print("Inserting time", time)
-            db.insert_one(data)
-
-            self.send_text(f"Saved time {time}.")
-            self.send_random_message()
-            self.send_motivation(time)
+            self.insert_time(
+                time, datetime.datetime.now(), callback=lambda placing: self.reply_to_submission(time, placing)
+            )
             return
 
         self.send_text("No time found in message. Please use !submit to submit your time.")
         return
 
+    @router.command("!submit")
     def store_time(self):
         """
         Saves a manual time submission into the db.
         """
 
-        db = self.get_db_collection("PlusWord", "Times")
-
-        today_date = datetime.date.today()
-        today_start = datetime.datetime(today_date.year, today_date.month, today_date.day)
-
-        if db.find_one({"phone_number": self.number, "load_ts": {'$gte': today_start}}):
-            self.send_text(f"You have already submitted a time for today. Use !edit to change your time.")
-            return
-        time = re.search(r"((\d+:)?[0-5][0-9]:[0-5][0-9])", self.msg_text)
+        time = TIME_PATTERN.search(self.msg_text)
 
         if time:
             time = time.group()
-            data = {
-                "user": self.msg_from,
-                "phone_number": self.number,
-                "time": time,
-                "load_ts": datetime.datetime.now()
-            }
-            db.insert_one(data)
-
-            self.send_text(f"Saved time {time}.")
-            self.send_random_message()
-            self.send_motivation(time)
+            if submitted.has_submitted(self.number):
+                self.reply_to_submission(time, None)
+                return
+            self.insert_time(
+                time, datetime.datetime.now(), callback=lambda placing: self.reply_to_submission(time, placing)
+            )
             return
 
         self.send_text("No time found in message. Please use format 00:00 to submit.")
         return
 
+    @router.command("!edit")
     def edit_time(self):
         """
         Replaces a preexisting time in the db with data entered by the user.
@@ -168,34 +189,40 @@ class Bot:
 
         db = self.get_db_collection("PlusWord", "Times")
 
-        today_date = datetime.date.today()
-        today_start = datetime.datetime(today_date.year, today_date.month, today_date.day)
-
-        if db.find_one({"phone_number": self.number, "load_ts": {'$gte': today_start}}) is None:
-            self.send_text(f"You have not submitted a time for today. Use !submit to submit your time.")
-            return
-
-        time = re.search(r"((\d+:)?[0-5][0-9]:[0-5][0-9])", self.msg_text)
+        time = TIME_PATTERN.search(self.msg_text)
 
         if time:
             time = time.group()
+            seconds = solve_time.to_seconds(time)
+            today = puzzle_date(datetime.datetime.now())
             data = {
-                "$set": {"time": time}
+                "$set": {"time": time, "seconds": seconds}
             }
-            db.update_one(
+            previous = db.find_one_and_update(
                 {
                     "phone_number": self.number,
-                    "load_ts": {'$gte': today_start}
+                    "puzzle_date": today
                 },
                 data
             )
+            if previous is None:
+                self.send_text(f"You have not submitted a time for today. Use !submit to submit your time.")
+                return
+            submitted.add(self.number, today)
+
+            previous_seconds = previous.get("seconds")
+            if previous_seconds is None:
+                previous_seconds = solve_time.to_seconds(previous["time"])
+            stats.record_edit(self.number, previous_seconds, seconds, today)
+            placing = leaderboard.record_edit(today, self.number, self.msg_from, seconds, time, previous["load_ts"])
 
-            self.send_text(f"Updated time to {time}.")
+            self.send_text(f"Updated time to {time}. {format_placing(*placing, 'today')}")
             return
 
         self.send_text("No time found in message. Please use format 00:00 to submit.")
         return
 
+    @router.command("!reminder")
     def reminder(self):
         """
         Enables, disables, or sets a reminder time in the db for use in the reminder script.
@@ -204,85 +231,44 @@ class Bot:
         Working on a new solution based on reminding 24 hours from previous submission.
         """
 
-        option = re.search(r"^!reminder ([A-z]+)", self.msg_text)
+        option = REMINDER_OPTION_PATTERN.search(self.msg_text)
 
         if not option:
             self.send_text("Please specify an option from enable, disable and set. Format: !reminder option [time].")
             return
 
         option = option.group(1).lower()
-        db = self.get_db_collection("PlusWord", "Reminders")
 
         if option == "enable":
-            time = re.search(r"^!reminder [A-z]+ ((?:[0-1]?[0-9]|2[0-3]):[0-5][0-9])", self.msg_text)
+            time = REMINDER_TIME_PATTERN.search(self.msg_text)
             if time:
                 time = time.group(1)
-                if db.find_one({"phone_number": self.number}):
-                    data = {
-                        "$set": {"enabled": True, "time": time}
-                    }
-                    db.update_one(
-                        {
-                            "phone_number": self.number
-                        },
-                        data
-                    )
-                    self.send_text(f"Notifications enabled, time set to {time}.")
-                else:
-                    data = {
-                        "phone_number": self.number,
-                        "time": time,
-                        "enabled": True
-                    }
-                    db.insert_one(data)
-                    self.send_text(f"Notifications enabled, time set to {time}.")
+                self.write_settings(
+                    "Reminders", {"enabled": True, "time": time}, f"Notifications enabled, time set to {time}.",
+                    upsert=True
+                )
             else:
-                if db.find_one({"phone_number": self.number}):
-                    data = {
-                        "$set": {"enabled": True}
-                    }
-                    db.update_one(
-                        {
-                            "phone_number": self.number
-                        },
-                        data
-                    )
-                    self.send_text(f"Notifications re-enabled.")
+                if settings.get("Reminders", self.number, fresh=True):
+                    self.write_settings("Reminders", {"enabled": True}, "Notifications re-enabled.")
                 else:
                     self.send_text("No time provided in message and no existing time found in database. "
                                    "Please provide a time to enable notifications.")
         elif option == "disable":
-            if db.find_one({"phone_number": self.number}):
-                data = {
-                    "$set": {"enabled": False}
-                }
-                db.update_one(
-                    {
-                        "phone_number": self.number
-                    },
-                    data
-                )
-                self.send_text("Notifications disabled.")
+            if settings.get("Reminders", self.number, fresh=True):
+                self.write_settings("Reminders", {"enabled": False}, "Notifications disabled.")
         elif option == "set":
-            time = re.search(r"^!reminder [A-z]+ ((?:[0-1]?[0-9]|2[0-3]):[0-5][0-9])", self.msg_text)
+            time = REMINDER_TIME_PATTERN.search(self.msg_text)
             if time:
                 time = time.group(1)
-                if db.find_one({"phone_number": self.number}):
-                    data = {
-                        "$set": {"enabled": True, "time": time}
-                    }
-                    db.update_one(
-                        {
-                            "phone_number": self.number
-                        },
-                        data
-                    )
-                    self.send_text(f"Reminder time updated to {time}.")
+                if settings.get("Reminders", self.number, fresh=True):
+                    reply = f"Reminder time updated to {time}."
+                    self.write_settings("Reminders", {"enabled": True, "time": time}, reply)
             else:
                 self.send_text("No time found in message. Format: !reminder set time.")
         else:
             self.send_text("Please specify an option from enable, disable and set. Format: !reminder option [time].")
 
+    @router.command("!retro")
     def retro(self):
         """
         Submits a retroactive PlusWord time. For use when the user doesn't submit on the day of the puzzle.
@@ -290,12 +276,7 @@ class Bot:
 
         # format
         # !retro 15-08-2023:13:15 01:45
-        db = self.get_db_collection("PlusWord", "Times")
-
-        match = re.search(
-            r"([0-9]{2}-[0-9]{2}-[0-9]{4}:[0-9]{2}:[0-9]{2}) ((\d+:)?[0-5][0-9]:[0-5][0-9])",
-            self.msg_text
-        )
+        match = RETRO_PATTERN.search(self.msg_text)
 
         if match:
             date = match.group(1)
@@ -307,36 +288,179 @@ class Bot:
                 self.send_text(f"Please use format !retro DD-MM-YYYY:hh:mm [hh:]mm:ss for retro submission.")
                 return
 
-            submission_datetime_start = datetime.datetime(
-                submission_datetime.year,
-                submission_datetime.month,
-                submission_datetime.day)
-            submission_datetime_end = submission_datetime_start + datetime.timedelta(days=1)
+            def reply(placing):
+                if placing is None:
+                    self.send_text(f"You have already submitted a time for this day.")
+                    return
+                self.send_text(f"Saved time {time} for {date}. {format_placing(*placing, 'that day')}")
 
-            if db.find_one({
-                "phone_number": self.number,
-                '$and': [
-                    {"load_ts": {'$gte': submission_datetime_start}},
-                    {"load_ts": {'$lt': submission_datetime_end}}
-                ]
-            }) is not None:
-                self.send_text(f"You have already submitted a time for this day.")
+            self.insert_time(time, submission_datetime, retro=True, callback=reply)
+            return
+
+        self.send_text(f"Please use format !retro DD-MM-YYYY:hh:mm [hh:]mm:ss for retro submission.")
+        return
+
+    def insert_time(self, time: str, load_ts: datetime.datetime, retro: bool = False, callback=None):
+        """
+        Queues a time as one conditional upsert keyed on phone number and puzzle date, followed by updates to the
+        user's stats and the day's leaderboard.
+        Once the batch is flushed, callback is called with the (rank, submissions) the time placed at that day, or
+        None if the user already has a time for that day.
+
+        Arguments:
+            time (str): time to store
+            load_ts (datetime): when the puzzle was completed
+            retro (bool): whether this is a retroactive submission
+            callback: called as callback(placing) once the time is stored
+        """
+
+        day = puzzle_date(load_ts)
+        data = {
+            "user": self.msg_from,
+            "phone_number": self.number,
+            "time": time,
+            "seconds": solve_time.to_seconds(time),
+            "load_ts": load_ts
+        }
+        if retro:
+            data["retro"] = True
+
+        def inserted(upserted_id, error):
+            if error is not None and error.get("code") != DUPLICATE_KEY_ERROR:
+                raise RuntimeError(f"Could not store time for {self.number}: {error.get('errmsg')}")
+            submitted.add(self.number, day)
+            if upserted_id is None:
+                # the user already has a time for the day, or lost a race with a concurrent delivery of the same one
+                callback(None)
                 return
 
-            data = {
-                "user": self.msg_from,
-                "phone_number": self.number,
-                "time": time,
-                "load_ts": submission_datetime,
-                "retro": True
-            }
-            db.insert_one(data)
+            stats.queue_submission(self.batch, self.number, self.msg_from, data["seconds"], day)
+            leaderboard.queue_submission(
+                self.batch, day, self.number, self.msg_from, data["seconds"], time, load_ts, callback
+            )
+
+        self.batch.add(
+            "Times",
+            UpdateOne({"phone_number": self.number, "puzzle_date": day}, {"$setOnInsert": data}, upsert=True),
+            inserted
+        )
+
+    def reply_to_submission(self, time: str, placing):
+        """
+        Replies to a submission for today once it has been stored.
+
+        Arguments:
+            time (str): time submitted
+            placing: the (rank, submissions) the time placed at, or None if the user already has a time for today
+        """
 
-            self.send_text(f"Saved time {time} for {date}.")
+        if placing is None:
+            self.send_text(f"You have already submitted a time for today. Use !edit to change your time.")
             return
 
-        self.send_text(f"Please use format !retro DD-MM-YYYY:hh:mm [hh:]mm:ss for retro submission.")
-        return
+        self.send_text(f"Saved time {time}. {format_placing(*placing, 'today')}")
+        self.send_random_message()
+        self.send_motivation(solve_time.to_seconds(time))
+
+    def write(self, collection: str, operation, reply: str = None, on_written=None):
+        """
+        Queues a write on the payload's write batch and sends a reply once it has been written.
+
+        Arguments:
+            collection (str): name of the PlusWord collection to write to
+            operation: pymongo write operation, e.g. UpdateOne
+            reply (str): text message body to be sent once written
+            on_written: called with no arguments once written
+        """
+
+        def written(upserted_id, error):
+            if error is not None:
+                raise RuntimeError(f"Write to {collection} for {self.number} failed: {error.get('errmsg')}")
+            if on_written:
+                on_written()
+            if reply:
+                self.send_text(reply)
+
+        self.batch.add(collection, operation, written)
+
+    def write_settings(self, collection: str, fields: dict, reply: str = None, upsert: bool = False):
+        """
+        Queues a $set of the user's Motivation or Reminders settings, writing it through to the settings cache once
+        it has been written.
+
+        Arguments:
+            collection (str): name of the settings collection
+            fields (dict): fields to set
+            reply (str): text message body to be sent once written
+            upsert (bool): whether to create the settings document if the user has none
+        """
+
+        self.write(
+            collection,
+            UpdateOne({"phone_number": self.number}, {"$set": fields}, upsert=upsert),
+            reply,
+            on_written=lambda: settings.put(collection, self.number, fields, upsert)
+        )
+
+    @router.command("!stats")
+    def send_stats(self):
+        """
+        Sends the user their submission count, average, personal best and streaks.
+        """
+
+        user_stats = stats.get_stats(self.number)
+        if not user_stats:
+            self.send_text("You haven't submitted any times yet. Use !submit to submit your time.")
+            return
+
+        average = round(user_stats["total_seconds"] / user_stats["count"])
+        self.send_text(
+            f"Times submitted: {user_stats['count']}\n"
+            f"Average: {solve_time.format_seconds(average)}\n"
+            f"Personal best: {solve_time.format_seconds(user_stats['best_seconds'])}"
+            f"{format_best_date(user_stats)}\n"
+            f"Current streak: {stats.current_streak(user_stats)}\n"
+            f"Longest streak: {user_stats.get('longest_streak', 0)}"
+        )
+
+    @router.command("!leaderboard")
+    def send_leaderboard(self):
+        """
+        Sends the leaderboard for today, or for the date given as !leaderboard DD-MM-YYYY.
+        """
+
+        match = LEADERBOARD_DATE_PATTERN.search(self.msg_text)
+        try:
+            day = datetime.datetime.strptime(match.group(1), "%d-%m-%Y") if match else datetime.datetime.now()
+        except ValueError:
+            self.send_text("Please use format !leaderboard [DD-MM-YYYY].")
+            return
+
+        board = leaderboard.get_leaderboard(puzzle_date(day))
+        if not board or not board.get("entries"):
+            self.send_text(f"No times have been submitted for {day.strftime('%d-%m-%Y')}.")
+            return
+
+        lines = [f"PlusWord leaderboard for {day.strftime('%d-%m-%Y')} ({board['submissions']} submitted):"]
+        for position, entry in enumerate(board["entries"], start=1):
+            lines.append(f"{position}. {entry['user']} {entry['time']}")
+        self.send_text("\n".join(lines))
+
+    @router.command("!pb")
+    def send_personal_best(self):
+        """
+        Sends the user their personal best time.
+        """
+
+        user_stats = stats.get_stats(self.number)
+        if not user_stats:
+            self.send_text("You haven't submitted any times yet. Use !submit to submit your time.")
+            return
+
+        self.send_text(
+            f"Your personal best is {solve_time.format_seconds(user_stats['best_seconds'])}"
+            f"{format_best_date(user_stats)}."
+        )
 
     def get_db_collection(self, database: str, collection: str):
         """
@@ -374,30 +498,21 @@ class Bot:
 
         self.send_text(random.choice(messages))
 
+    @router.command("!motivation")
     def motivation(self):
         """
         Enables, disables, or sets a motivation message flag in the db for use in the send_motivation function.
         """
-        option = re.search(r"^!motivation ([A-z]+)", self.msg_text)
+        option = MOTIVATION_OPTION_PATTERN.search(self.msg_text)
         if not option:
             self.send_text("Please specify an option from enable, disable, or set. Format: !motivation option.")
+            return
 
         option = option.group(1).lower()
 
-        db = self.get_db_collection("PlusWord", "Motivation")
-
         if option == "enable":
-            data = {
-                "$set": {"enabled": True, "phone_number": self.number}
-            }
-            db.update_one(
-                {
-                    "phone_number": self.number
-                },
-                data,
-                upsert=True
-            )
-            self.send_text(f"""Motivation enabled for you my {
+            data = {"enabled": True, "phone_number": self.number}
+            self.write_settings("Motivation", data, f"""Motivation enabled for you my {
             random.choice([
                 'adorable sweetheart',
                 'brilliant genius',
@@ -428,21 +543,12 @@ class Bot:
                 'fearless leader',
                 'graceful swan'
             ])
-            }.""")
+            }.""", upsert=True)
         elif option == "disable":
-            data = {
-                "$set": {"enabled": False, "phone_number": self.number}
-            }
-            db.update_one(
-                {
-                    "phone_number": self.number
-                },
-                data,
-                upsert=True
-            )
-            self.send_text(f"""Motivation disabled. I'm always here for you if you need me 🤖.""")
+            reply = "Motivation disabled. I'm always here for you if you need me 🤖."
+            self.write_settings("Motivation", {"enabled": False, "phone_number": self.number}, reply, upsert=True)
         elif option == "set":
-            time = re.search(r"^!motivation [A-z]+ ((\d+:)?[0-5][0-9]:[0-5][0-9])", self.msg_text)
+            time = MOTIVATION_TIME_PATTERN.search(self.msg_text)
             if not time:
                 self.send_text("Please specify a valid time.")
                 return
@@ -450,40 +556,26 @@ class Bot:
             time = time.group(1)
 
             data = {
-                "$set": {"enabled": False, "phone_number": self.number, "minimum_time": time}
+                "enabled": False,
+                "phone_number": self.number,
+                "minimum_time": time,
+                "minimum_seconds": solve_time.to_seconds(time)
             }
+            reply = f"Motivation minimum set to {time}. I'm sure it won't be there for long! 🦾"
+            self.write_settings("Motivation", data, reply, upsert=True)
 
-            db.update_one(
-                {
-                    "phone_number": self.number
-                },
-                data,
-                upsert=True
-            )
-            self.send_text(f"""Motivation minimum set to {time}. I'm sure it won't be there for long! 🦾""")
-
-    def send_motivation(self, time):
+    def send_motivation(self, seconds: int):
         """
         Sends a variable motivational message based on the users time and their preset minimum time.
-        """
-        db = self.get_db_collection("PlusWord", "Motivation")
 
-        if result := db.find_one({"$and": [{"phone_number": self.number}, {"enabled": True}]}):
-            minimum_time = re.match(
-                r"(\d+:)?([0-5][0-9]):([0-5][0-9])",
-                result.get("minimum_time") if result.get("minimum_time") is not None else "01:00",
-            )
-            minimum_time = datetime.timedelta(
-                hours=int(minimum_time.group(1)) if minimum_time.group(1) else 0,
-                minutes=int(minimum_time.group(2)),
-                seconds=int(minimum_time.group(3))
-            )
-            time = re.match(r"(\d+:)?([0-5][0-9]):([0-5][0-9])", time)
-            time = datetime.timedelta(
-                hours=int(time.group(1)) if time.group(1) else 0,
-                minutes=int(time.group(2)),
-                seconds=int(time.group(3))
-            )
+        Arguments:
+            seconds (int): the user's solve time in seconds
+        """
+        result = settings.get("Motivation", self.number)
+        if result and result.get("enabled"):
+            minimum_seconds = result.get("minimum_seconds")
+            if minimum_seconds is None:
+                minimum_seconds = solve_time.to_seconds(result.get("minimum_time") or DEFAULT_MINIMUM_TIME)
             messages = [
                 "Lightning fast! You crushed it! ⚡",
                 "You're a puzzle-solving wizard! 🧙‍️",
@@ -515,7 +607,7 @@ class Bot:
                 "Outstanding work! You aced it! 📈",
                 "You're brilliant! Keep shining! 🌟",
                 "You did it again! You're unstoppable! 🌠"
-            ] if time < minimum_time else [
+            ] if seconds < minimum_seconds else [
                 "Great effort! You'll nail it next time! 🧩",
                 "Almost there! Keep trying, success is within reach! 💪",
                 "Nice try! Every attempt brings you closer! 🌟",
@@ -550,37 +642,189 @@ class Bot:
             self.send_text(random.choice(messages))
 
 
+def iter_messages(json_in):
+    """
+    Yields every message in a webhook payload, across all of its entries and changes, with the contact entry of
+    its sender.
+
+    Arguments:
+        json_in: incoming json received from webhook containing message data
+    """
+
+    for entry in json_in.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            contacts = {contact.get("wa_id"): contact for contact in value.get("contacts") or []}
+            for message in value.get("messages") or []:
+                yield message, contacts.get(message.get("from"), {})
+
+
+def sender(json_in):
+    """
+    Returns the phone number of the first message's sender in a webhook payload, used to keep each sender's
+    payloads in order on the work queue.
+
+    Arguments:
+        json_in: incoming json received from webhook containing message data
+    """
+
+    for message, contact in iter_messages(json_in):
+        return contact.get("wa_id") or message.get("from")
+
+
+def handle_webhook(json_in):
+    """
+    Processes a webhook payload taken off the work queue, runs on a background worker thread. Every message in the
+    payload is routed to its handler and their DB writes are flushed together, one bulk_write per collection, then
+    each sender's replies are sent as one message.
+
+    Arguments:
+        json_in: incoming json received from webhook containing message data
+    """
+
+    senders = [message.get("from") for message, _ in iter_messages(json_in)]
+    with log_config.context(phone_numbers=senders):
+        try:
+            with metrics.profiled("webhook"), metrics.timed("webhook"):
+                process_messages(json_in)
+        except Exception as ex:
+            logging.exception(f"{datetime.datetime.now()}: {ex}")
+
+
+def process_messages(json_in):
+    """
+    Claims every message in a webhook payload with one insert, dropping redeliveries, routes the rest to their
+    handlers, then flushes their writes and replies. Messages whose writes fail are released so a redelivery is
+    handled again.
+
+    Arguments:
+        json_in: incoming json received from webhook containing message data
+    """
+
+    messages = list(iter_messages(json_in))
+    try:
+        duplicates = dedup.claim([message.get("id") for message, _ in messages if message.get("id")])
+    except Exception as ex:
+        # handle the messages anyway, a lost message is worse than the rare double reply
+        logging.exception(f"Could not claim messages: {ex}")
+        duplicates = set()
+
+    batch = WriteBatch()
+    outbox = Outbox()
+    senders = set()
+    handled = set()
+    try:
+        for message, contact in messages:
+            message_id = message.get("id")
+            if message_id and (message_id in duplicates or message_id in handled):
+                logging.info(f"Dropped redelivered message {message_id}.")
+                continue
+            handled.add(message_id)
+
+            bot = Bot(message, contact, batch, outbox)
+            if bot.number in senders:
+                # a sender's later message may depend on the writes of their earlier one
+                with metrics.timed("batch_flush"):
+                    batch.flush()
+                senders.clear()
+            senders.add(bot.number)
+
+            # writes queued while handling the message are recorded against it
+            batch.key = message_id
+            try:
+                with log_config.context(message_id=message_id), \
+                        metrics.timed("command", COMMAND_SECONDS, command=router.route(bot)):
+                    router.dispatch(bot)
+            except Exception as ex:
+                logging.exception(f"{datetime.datetime.now()}: {ex}")
+        with metrics.timed("batch_flush"):
+            batch.flush()
+    finally:
+        dedup.release(batch.failed)
+        # replies to the messages that were handled are sent even if the flush fails part way
+        with metrics.timed("outbox_flush"):
+            outbox.flush()
+
+
+def is_message_payload(json_in) -> bool:
+    """
+    Checks that a webhook payload has the expected shape and contains at least one message.
+
+    Arguments:
+        json_in: incoming json received from webhook
+    """
+
+    try:
+        return any(True for _ in iter_messages(json_in))
+    except (AttributeError, TypeError):
+        return False
+
+
+work_queue = WorkQueue(
+    handle_webhook,
+    workers=int(os.environ.get("PLUSWORD_WORKERS", 4)),
+    maxsize=int(os.environ.get("PLUSWORD_QUEUE_SIZE", 100)),
+    key=sender
+)
+atexit.register(work_queue.shutdown)
+metrics.gauge("plusword_work_queue_depth", "Webhook payloads waiting for a worker.", work_queue.qsize)
+
+log_config.configure("log.txt")
+# fail on startup rather than on the first message if credentials are missing
+cm.get_credentials()
+
 app = Flask(__name__)
 
 
+def accept(json_in) -> str:
+    """
+    Queues a webhook payload for the background workers unless it can be acknowledged without processing.
+    Returns what was done with it: queued, redelivery, ignored or rejected when the queue is full.
+
+    Arguments:
+        json_in: incoming json received from webhook
+    """
+
+    if not is_message_payload(json_in):
+        return "ignored"
+    message_ids = [message.get("id") for message, _ in iter_messages(json_in)]
+    if all([message_id and dedup.seen(message_id) for message_id in message_ids]):
+        # a redelivery of messages already taken on, acknowledge it so Meta stops retrying
+        return "redelivery"
+    if not work_queue.submit(json_in, timeout=QUEUE_SUBMIT_TIMEOUT):
+        return "rejected"
+    return "queued"
+
+
 @app.route('/', methods=['POST', 'GET'])
 def home():
     """
-    Default and only access point to the API, handles creation of bot for each instance of webhook data.
+    Default and only access point to the API. Validates webhook data and queues it for the background workers so
+    the webhook is acknowledged straight away.
     """
-    logging.basicConfig(filename="log.txt", level=logging.INFO)
     try:
         if request.method == "GET":
             if request.args.get('hub.verify_token') == "vtoken":
                 return request.args.get('hub.challenge')
             return "Authentication failed. Invalid Token."
         if request.method == 'POST':
-            if not request.json.get("entry")[0].get("changes")[0].get("value").get("messages"):
-                return ""
-            bot = Bot(request.json)
-            if bot.type == "image":
-                bot.store_time_from_image()
-            if re.search("^!submit", bot.msg_text):
-                bot.store_time()
-            if re.search("^!edit", bot.msg_text):
-                bot.edit_time()
-            if re.search("^!reminder", bot.msg_text):
-                bot.reminder()
-            if re.search("^!retro", bot.msg_text):
-                bot.retro()
-            if re.search("^!motivation", bot.msg_text):
-                bot.motivation()
+            request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
+            with log_config.context(request_id=request_id), metrics.timed("webhook_ack"):
+                result = accept(request.get_json(silent=True))
+            WEBHOOK_REQUESTS.inc(result=result)
+            if result == "rejected":
+                # queue is full, ask Meta to redeliver later rather than dropping the message
+                return "", 503
         return ""
     except Exception as ex:
         logging.exception(f"{datetime.datetime.now()}: {ex}")
         return ""
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus metrics for this worker process.
+    """
+
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
@@ -0,0 +1,232 @@
+import datetime
+import heapq
+import logging
+import os
+import queue
+import threading
+from pymongo.errors import PyMongoError
+import credential_manager as cm
+import db as mongo
+import log_config
+import metrics
+from schedule_reminders import check_if_valid_reminder, send_reminders
+
+# seconds between reminder config reloads when change streams aren't available
+POLL_INTERVAL = float(os.environ.get("PLUSWORD_REMINDER_POLL_INTERVAL", 60))
+# how long after its minute a reminder still fires, e.g. after a restart
+GRACE = datetime.timedelta(minutes=1)
+REMINDER_WINDOW = datetime.timedelta(hours=23, minutes=59)
+
+
+def fire_time(day: datetime.date, reminder_time: str, last_submission: datetime.datetime):
+    """
+    Returns when a reminder is due on a day, or None if it falls after the 23h59 window that opened with the
+    player's previous submission.
+
+    Arguments:
+        day (date): day the reminder is for
+        reminder_time (str): reminder time of day as HH:MM
+        last_submission (datetime): load_ts of the player's submission the day before
+    """
+
+    reminder = datetime.datetime.strptime(reminder_time, "%H:%M")
+    fire_at = datetime.datetime.combine(day, datetime.time(reminder.hour, reminder.minute))
+    if fire_at > last_submission + REMINDER_WINDOW:
+        return None
+    return fire_at
+
+
+class ReminderScheduler:
+    """
+    Resident reminder scheduler. Loads the day's reminder configs once, keeps a min-heap of next fire times and
+    sleeps until the next reminder is due. Changes made with !reminder are applied incrementally from a change stream
+    on Reminders, or by polling when change streams aren't available.
+    """
+
+    def __init__(self):
+        """
+        Constructor for ReminderScheduler class.
+        """
+
+        self.day = None
+        self._heap = []
+        self._scheduled = {}
+        self._fired = set()
+        self._submissions = {}
+        self._changes = queue.Queue()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._watching = False
+        self._last_poll = None
+
+    def load(self):
+        """
+        Rebuilds the schedule for today from yesterday's submissions and their players' reminder configs.
+        """
+
+        day = datetime.date.today()
+        yesterday_start = datetime.datetime.combine(day - datetime.timedelta(days=1), datetime.time())
+        today_start = datetime.datetime.combine(day, datetime.time())
+
+        times = mongo.get_collection("PlusWord", "Times")
+        self._submissions = {
+            submission["phone_number"]: submission["load_ts"]
+            for submission in times.find(
+                {"load_ts": {"$gte": yesterday_start, "$lt": today_start}},
+                {"_id": 0, "phone_number": 1, "load_ts": 1}
+            )
+        }
+
+        self.day = day
+        self._heap = []
+        self._scheduled = {}
+        self._fired = set()
+        self.poll()
+        logging.info(f"Loaded {len(self._scheduled)} reminders for {self.day}.")
+
+    def poll(self):
+        """
+        Re-reads the reminder configs of everyone who submitted yesterday and reschedules any that changed.
+        """
+
+        reminders = mongo.get_collection("PlusWord", "Reminders")
+        configs = {
+            config["phone_number"]: config
+            for config in reminders.find(
+                {"phone_number": {"$in": list(self._submissions)}},
+                {"_id": 0, "phone_number": 1, "enabled": 1, "time": 1}
+            )
+        }
+        for phone_number in self._submissions:
+            self.apply(phone_number, configs.get(phone_number))
+        self._last_poll = datetime.datetime.now()
+
+    def apply(self, phone_number: str, config):
+        """
+        Schedules, reschedules or cancels one player's reminder.
+
+        Arguments:
+            phone_number (str): phone number of the player
+            config: the player's Reminders document, or None if they have none
+        """
+
+        last_submission = self._submissions.get(phone_number)
+        fire_at = None
+        if phone_number in self._fired:
+            # players are reminded at most once a day
+            return
+        if last_submission and config and config.get("enabled") and config.get("time"):
+            fire_at = fire_time(self.day, config["time"], last_submission)
+            if fire_at and fire_at + GRACE <= datetime.datetime.now():
+                fire_at = None
+
+        if fire_at is None:
+            self._scheduled.pop(phone_number, None)
+        elif self._scheduled.get(phone_number) != fire_at:
+            self._scheduled[phone_number] = fire_at
+            heapq.heappush(self._heap, (fire_at, phone_number))
+
+    def watch(self):
+        """
+        Follows the Reminders change stream on a background thread, handing changes to the scheduler loop.
+        Falls back to polling if the deployment doesn't support change streams.
+        """
+
+        def follow():
+            try:
+                with mongo.get_collection("PlusWord", "Reminders").watch(full_document="updateLookup") as stream:
+                    self._watching = True
+                    for change in stream:
+                        if document := change.get("fullDocument"):
+                            self._changes.put(document)
+                            self._wake.set()
+                        if self._stopping.is_set():
+                            return
+            except (PyMongoError, NotImplementedError) as ex:
+                logging.warning(f"Reminders change stream unavailable, polling every {POLL_INTERVAL}s: {ex}")
+            finally:
+                self._watching = False
+
+        threading.Thread(target=follow, name="reminder-change-stream", daemon=True).start()
+
+    def _apply_changes(self):
+        while True:
+            try:
+                document = self._changes.get_nowait()
+            except queue.Empty:
+                return
+            self.apply(document.get("phone_number"), document)
+
+    def _next_wake(self, now: datetime.datetime) -> float:
+        tomorrow = datetime.datetime.combine(self.day + datetime.timedelta(days=1), datetime.time())
+        wake = tomorrow
+        if self._heap:
+            wake = min(wake, self._heap[0][0])
+        if not self._watching:
+            wake = min(wake, self._last_poll + datetime.timedelta(seconds=POLL_INTERVAL))
+        return max((wake - now).total_seconds(), 0)
+
+    def fire_due(self):
+        """
+        Sends every reminder that is due and still valid as one concurrent batch.
+        """
+
+        now = datetime.datetime.now()
+        due = []
+        scheduled_for = None
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, phone_number = heapq.heappop(self._heap)
+            if self._scheduled.get(phone_number) != fire_at:
+                # superseded by a later change to the player's reminder
+                continue
+            del self._scheduled[phone_number]
+            self._fired.add(phone_number)
+            scheduled_for = scheduled_for or fire_at
+            if check_if_valid_reminder(phone_number):
+                due.append(phone_number)
+
+        if due:
+            send_reminders(due, scheduled_for=scheduled_for)
+
+    def run(self):
+        """
+        Runs the scheduler until stop() is called.
+        """
+
+        self.watch()
+        while not self._stopping.is_set():
+            self._wake.clear()
+            now = datetime.datetime.now()
+            try:
+                if now.date() != self.day:
+                    self.load()
+                elif not self._watching and now >= self._last_poll + datetime.timedelta(seconds=POLL_INTERVAL):
+                    self.poll()
+                self._apply_changes()
+                self.fire_due()
+            except Exception as ex:
+                logging.exception(f"{datetime.datetime.now()}: {ex}")
+                self._stopping.wait(POLL_INTERVAL)
+                continue
+
+            self._wake.wait(self._next_wake(datetime.datetime.now()))
+
+    def stop(self):
+        """
+        Stops the scheduler loop.
+        """
+
+        self._stopping.set()
+        self._wake.set()
+
+
+def main():
+    log_config.configure("reminder_log.log")
+    cm.get_credentials()
+    if port := os.environ.get("PLUSWORD_METRICS_PORT"):
+        metrics.serve(int(port))
+    ReminderScheduler().run()
+
+
+if __name__ == "__main__":
+    main()
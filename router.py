@@ -0,0 +1,99 @@
+import re
+
+COMMAND_PATTERN = re.compile(r"![A-Za-z]+")
+
+
+class CommandRouter:
+    """
+    Dispatches a received message to the handler registered for it. Text messages are routed on their first token
+    with a single dictionary lookup, images go to the image handler and anything else to the unknown handler.
+    """
+
+    def __init__(self):
+        """
+        Constructor for CommandRouter class.
+        """
+
+        self._commands = {}
+        self._image_handler = None
+        self._unknown_handler = None
+
+    def command(self, *names: str):
+        """
+        Decorator registering a handler for one or more commands, e.g. @router.command("!submit").
+
+        Arguments:
+            names (str): commands handled, matched against the first token of a text message
+        """
+
+        def register(handler):
+            for name in names:
+                if name in self._commands:
+                    raise ValueError(f"Command {name} is already registered.")
+                self._commands[name] = handler
+            return handler
+
+        return register
+
+    def image(self, handler):
+        """
+        Decorator registering the handler for image messages.
+        """
+
+        self._image_handler = handler
+        return handler
+
+    def unknown(self, handler):
+        """
+        Decorator registering the handler for text that isn't a command and for unsupported message types.
+        """
+
+        self._unknown_handler = handler
+        return handler
+
+    def commands(self) -> [str]:
+        """
+        Returns the registered command names.
+        """
+
+        return list(self._commands)
+
+    def resolve(self, bot):
+        """
+        Returns the handler for a bot's message, or None if nothing handles it.
+
+        Arguments:
+            bot: Bot holding the received message
+        """
+
+        if bot.type == "image":
+            return self._image_handler
+        if bot.type == "text" and bot.msg_text and (token := COMMAND_PATTERN.match(bot.msg_text)):
+            return self._commands.get(token.group(), self._unknown_handler)
+        return self._unknown_handler
+
+    def route(self, bot) -> str:
+        """
+        Returns a name for the route a bot's message takes, the command for text messages, for use in metrics.
+
+        Arguments:
+            bot: Bot holding the received message
+        """
+
+        if bot.type == "image":
+            return "image"
+        if bot.type == "text" and bot.msg_text and (token := COMMAND_PATTERN.match(bot.msg_text)):
+            if token.group() in self._commands:
+                return token.group()
+        return "unknown"
+
+    def dispatch(self, bot):
+        """
+        Runs the handler for a bot's message.
+
+        Arguments:
+            bot: Bot holding the received message
+        """
+
+        if handler := self.resolve(bot):
+            handler(bot)
@@ -1,74 +1,86 @@
-import pymongo
 import credential_manager as cm
+import db as mongo
+import dispatcher
+import log_config
+import settings
+import submitted
 import datetime
 import logging
-import requests
 
+REMINDER_TEXT = "nice ones all so far"
 
-def get_reminders() -> [{str: str}]:
+
+def get_reminders() -> [str]:
     """
-    Gets the dictionary of player reminder data from the DB.
+    Gets the phone numbers of the players whose reminder is due this minute, in a single aggregation.
+
+    A player is due if they submitted yesterday, within 23h59 of now, have a reminder enabled for the current time
+    of day and haven't submitted today.
     """
 
-    client = pymongo.MongoClient(cm.get_db_connection_string())
-    reminders = client["PlusWord"]["Reminders"]
-    times = client["PlusWord"]["Times"]
+    times = mongo.get_collection("PlusWord", "Times")
 
-    yesterday_date = datetime.date.today() + datetime.timedelta(days=-1)
     today_date = datetime.date.today()
     now = datetime.datetime.now()
-    yesterday_start = datetime.datetime(yesterday_date.year, yesterday_date.month, yesterday_date.day)
-    yesterday_end = datetime.datetime(today_date.year, today_date.month, today_date.day)
+    yesterday_start = datetime.datetime.combine(today_date - datetime.timedelta(days=1), datetime.time())
+    today_start = datetime.datetime.combine(today_date, datetime.time())
     now_to_minute = datetime.datetime(now.year, now.month, now.day, now.hour, now.minute)
-
-    yesterday_submissions = times.find({"load_ts": {'$gte': yesterday_start, '$lt': yesterday_end}})
-
-    reminder_data = dict()
-    for submission in yesterday_submissions:
-        reminder_config = reminders.find_one({"phone_number": submission.get("phone_number")})
-        if not reminder_config:
-            continue
-        reminder_time = datetime.datetime.strptime(reminder_config["time"],"%H:%M")
-        reminder_delta = datetime.timedelta(hours=reminder_time.hour, minutes=reminder_time.minute)
-        time_to_remind = min(submission.get("load_ts") + datetime.timedelta(hours=23, minutes=59),
-                             datetime.datetime(today_date.year, today_date.month, today_date.day, 0, 0) + reminder_delta
-                             )
-        if time_to_remind < now_to_minute:
-            continue
-        reminder_data[submission.get("phone_number")] = {
-            "enabled": reminder_config["enabled"],
-            "reminder_time": reminder_config["time"]
-        }
-
-    return reminder_data
-
-
-def send_reminder(phone_number):
+    # reminder times can be stored with or without a leading zero on the hour
+    reminder_times = list({now.strftime("%H:%M"), f"{now.hour}:{now.minute:02}"})
+
+    pipeline = [
+        # yesterday's submissions whose 23h59 reply window is still open
+        {"$match": {"load_ts": {
+            "$gte": max(yesterday_start, now_to_minute - datetime.timedelta(hours=23, minutes=59)),
+            "$lt": today_start
+        }}},
+        {"$group": {"_id": "$phone_number"}},
+        {"$lookup": {
+            "from": "Reminders",
+            "let": {"phone_number": "$_id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$eq": ["$phone_number", "$$phone_number"]},
+                    "enabled": True,
+                    "time": {"$in": reminder_times}
+                }},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "reminder"
+        }},
+        {"$match": {"reminder": {"$ne": []}}},
+        {"$lookup": {
+            "from": "Times",
+            "let": {"phone_number": "$_id"},
+            "pipeline": [
+                {"$match": {
+                    "$expr": {"$eq": ["$phone_number", "$$phone_number"]},
+                    "load_ts": {"$gte": today_start}
+                }},
+                {"$limit": 1},
+                {"$project": {"_id": 1}}
+            ],
+            "as": "submitted_today"
+        }},
+        {"$match": {"submitted_today": []}},
+        {"$project": {"_id": 1}}
+    ]
+
+    return [result["_id"] for result in times.aggregate(pipeline)]
+
+
+def send_reminders(phone_numbers: [str], scheduled_for: datetime.datetime = None):
     """
-    Sends reminder to the player.
+    Sends reminders to a batch of players concurrently and within the Graph API rate limit.
 
     Arguments:
-        phone_number: the phone number of the player to remind
+        phone_numbers ([str]): phone numbers of the players to remind
+        scheduled_for (datetime): when the reminders were due
     """
 
-    header = {
-        "Authorization": f"Bearer {cm.get_whatsapp_key()}"
-    }
-
-    url = f"https://graph.facebook.com/v21.0/{cm.get_whatsapp_page_id()}/messages"
-
-    body = {
-        "messaging_product": "whatsapp",
-        "recipient_type": "individual",
-        "to": phone_number,
-        "type": "text",
-        "text": {
-            "preview_url": True,
-            "body": "nice ones all so far"
-        }
-    }
-    requests.post(url=url, json=body, headers=header)
-    logging.info(f"Sent reminder to {phone_number}.")
+    outcomes = dispatcher.dispatch(phone_numbers, REMINDER_TEXT, scheduled_for=scheduled_for, kind="reminder")
+    sent = sum(outcome["status"] == "sent" for outcome in outcomes)
+    logging.info(f"Sent {sent} of {len(outcomes)} reminders.")
 
 
 def check_if_valid_reminder(phone_number: str):
@@ -86,32 +98,33 @@ def check_if_valid_reminder(phone_number: str):
     today_date = datetime.date.today()
     today_start = datetime.datetime(today_date.year, today_date.month, today_date.day, 0, 0, 0)
 
-    client = pymongo.MongoClient(cm.get_db_connection_string())
+    client = mongo.get_client()
 
-    reminders = client["PlusWord"]["Reminders"]
-    player_reminder = reminders.find_one({"$and": [{"enabled": True}, {"phone_number": phone_number}]})
+    # read past the settings cache, a stale entry would veto a reminder the scheduler has just scheduled
+    player_reminder = settings.get("Reminders", phone_number, fresh=True)
+    if not player_reminder or not player_reminder.get("enabled"):
+        return False
+
+    if submitted.has_submitted(phone_number):
+        return False
 
-    submitted = client["PlusWord"]["Times"]
-    player_submission = submitted.find_one(
+    times = client["PlusWord"]["Times"]
+    player_submission = times.find_one(
         {"$and": [{"load_ts": {'$gte': today_start}}, {"phone_number": phone_number}]})
 
     if player_submission:
-        return False
-
-    if not player_reminder:
+        submitted.add(phone_number, today_date.isoformat())
         return False
 
     return True
 
 
 def main():
-    logging.basicConfig(filename="reminder_log.log", level=logging.INFO)
-    reminders = get_reminders()
-    logging.info(reminders)
-    for phone_number, values in reminders.items():
-        if check_if_valid_reminder(phone_number) and values.get('enabled'):
-            if datetime.datetime.now().strftime('%H:%M') == values.get('reminder_time'):
-                send_reminder(phone_number)
+    log_config.configure("reminder_log.log")
+    cm.get_credentials()
+    phone_numbers = get_reminders()
+    logging.info(f"{len(phone_numbers)} reminders due.")
+    send_reminders(phone_numbers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,287 @@
+import argparse
+import datetime
+import logging
+import sys
+import pymongo
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+import credential_manager as cm
+import db as mongo
+import dedup
+import dispatcher
+import leaderboard
+import ocr_cache
+import solve_time
+import stats
+
+DATABASE = "PlusWord"
+
+# collection: indexes the hot queries need
+INDEXES = {
+    "Times": [
+        # duplicate checks, edits and reminder eligibility: phone number plus a load_ts range
+        IndexModel([("phone_number", pymongo.ASCENDING), ("load_ts", pymongo.ASCENDING)]),
+        # reminder scheduling: everything submitted in a load_ts range
+        IndexModel([("load_ts", pymongo.ASCENDING)]),
+        # one submission per user per puzzle, enforced by the database for submission upserts and edits.
+        # partial so legacy same-day duplicates left without a puzzle_date by the backfill don't block the build
+        IndexModel(
+            [("phone_number", pymongo.ASCENDING), ("puzzle_date", pymongo.ASCENDING)],
+            unique=True,
+            partialFilterExpression={"puzzle_date": {"$exists": True}}
+        ),
+        # leaderboard rank for times that didn't make the day's top entries
+        IndexModel([("puzzle_date", pymongo.ASCENDING), ("seconds", pymongo.ASCENDING)]),
+    ],
+    "Reminders": [
+        IndexModel([("phone_number", pymongo.ASCENDING)], unique=True),
+    ],
+    "Motivation": [
+        IndexModel([("phone_number", pymongo.ASCENDING)], unique=True),
+    ],
+    "OcrCache": [
+        IndexModel([("created_at", pymongo.ASCENDING)], expireAfterSeconds=ocr_cache.OCR_CACHE_TTL),
+        # screenshots a new one is compared against: the most recent perceptual hashes of the same shape
+        IndexModel(
+            [("phash_shape", pymongo.ASCENDING), ("created_at", pymongo.DESCENDING)],
+            partialFilterExpression={"phash_shape": {"$exists": True}}
+        ),
+    ],
+    "ProcessedMessages": [
+        IndexModel([("created_at", pymongo.ASCENDING)], expireAfterSeconds=dedup.DEDUP_TTL),
+    ],
+    "Dispatches": [
+        IndexModel([("sent_at", pymongo.ASCENDING)], expireAfterSeconds=dispatcher.DISPATCH_HISTORY_TTL),
+        IndexModel([("phone_number", pymongo.ASCENDING), ("sent_at", pymongo.ASCENDING)]),
+    ],
+}
+
+# representative hot queries as (description, collection, filter) for explain plans
+_today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+QUERIES = [
+    ("Times submission upsert and edit", "Times", {"phone_number": "", "puzzle_date": ""}),
+    ("Times submitted today check", "Times", {"$and": [{"load_ts": {"$gte": _today}}, {"phone_number": ""}]}),
+    ("Times faster than a time that day", "Times", {"puzzle_date": "", "seconds": {"$lt": 0}}),
+    ("Times yesterday's submissions", "Times", {"load_ts": {"$gte": _today, "$lt": _today}}),
+    ("Reminders by phone number", "Reminders", {"phone_number": ""}),
+    ("Reminders enabled by phone number", "Reminders", {"$and": [{"enabled": True}, {"phone_number": ""}]}),
+    ("Motivation enabled by phone number", "Motivation", {"$and": [{"phone_number": ""}, {"enabled": True}]}),
+]
+
+BATCH_SIZE = 1000
+
+
+def backfill_puzzle_date(database):
+    """
+    Sets puzzle_date on every Times document that predates it. Where a user has several documents for the same day
+    only the earliest gets a puzzle_date, the rest are logged and left out of the unique index.
+    """
+
+    times = database["Times"]
+    claimed = {
+        (document["phone_number"], document["puzzle_date"])
+        for document in times.find({"puzzle_date": {"$exists": True}}, {"phone_number": 1, "puzzle_date": 1})
+    }
+
+    batch = []
+    cursor = times.find(
+        {"puzzle_date": {"$exists": False}},
+        {"phone_number": 1, "load_ts": 1}
+    ).sort("load_ts", pymongo.ASCENDING).batch_size(BATCH_SIZE)
+    for document in cursor:
+        key = (document.get("phone_number"), document["load_ts"].date().isoformat())
+        if key in claimed:
+            logging.warning(f"Times {document['_id']} duplicates a submission for {key[1]}, leaving it unkeyed.")
+            continue
+        claimed.add(key)
+        batch.append(pymongo.UpdateOne({"_id": document["_id"]}, {"$set": {"puzzle_date": key[1]}}))
+        if len(batch) >= BATCH_SIZE:
+            times.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        times.bulk_write(batch, ordered=False)
+
+
+def backfill_seconds(database):
+    """
+    Sets the integer seconds field on Times documents and minimum_seconds on Motivation documents stored before they
+    existed, in batches.
+    """
+
+    for collection, source, target in (("Times", "time", "seconds"), ("Motivation", "minimum_time", "minimum_seconds")):
+        batch = []
+        cursor = database[collection].find(
+            {target: {"$exists": False}, source: {"$type": "string"}},
+            {source: 1}
+        ).batch_size(BATCH_SIZE)
+        for document in cursor:
+            try:
+                seconds = solve_time.to_seconds(document[source])
+            except ValueError:
+                logging.warning(f"{collection} {document['_id']} has an unreadable {source} {document[source]!r}.")
+                continue
+            batch.append(pymongo.UpdateOne({"_id": document["_id"]}, {"$set": {target: seconds}}))
+            if len(batch) >= BATCH_SIZE:
+                database[collection].bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            database[collection].bulk_write(batch, ordered=False)
+
+
+def build_user_stats(database):
+    """
+    Builds the UserStats collection from the existing Times history.
+    """
+
+    stats.rebuild(database)
+
+
+def build_daily_leaderboard(database):
+    """
+    Builds the DailyLeaderboard collection from the existing Times history.
+    """
+
+    leaderboard.rebuild(database)
+
+
+# migrations run once, in order, and are recorded in the Migrations collection
+MIGRATIONS = [
+    backfill_puzzle_date,
+    backfill_seconds,
+    build_user_stats,
+    build_daily_leaderboard,
+]
+# migrations that rebuild whole collections, left to `python schema.py migrate` rather than run on startup
+LONG_MIGRATIONS = {build_user_stats, build_daily_leaderboard}
+
+
+def get_database():
+    return mongo.get_client()[DATABASE]
+
+
+def _index_key(index: IndexModel) -> tuple:
+    return tuple(index.document["key"].items())
+
+
+def ensure_indexes() -> [str]:
+    """
+    Creates any missing indexes. Returns a list of problems, e.g. a unique index that can't be built because the
+    collection already holds duplicates.
+    """
+
+    database = get_database()
+    problems = []
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                database[collection].create_indexes([index])
+            except OperationFailure as e:
+                problems.append(f"{collection}: could not create index {index.document['name']}: {e}")
+    return problems
+
+
+def verify_indexes() -> [str]:
+    """
+    Returns a list of the indexes in INDEXES that are missing from the database.
+    """
+
+    database = get_database()
+    missing = []
+    for collection, indexes in INDEXES.items():
+        existing = {tuple(info["key"]) for info in database[collection].index_information().values()}
+        for index in indexes:
+            if _index_key(index) not in existing:
+                missing.append(f"{collection}: missing index {index.document['name']}")
+    return missing
+
+
+def _plan_stages(plan: dict) -> [str]:
+    stages = [plan.get("stage")]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def explain_queries() -> [str]:
+    """
+    Explains each query in QUERIES and returns a list of those whose winning plan is a collection scan.
+    """
+
+    database = get_database()
+    uncovered = []
+    for description, collection, query in QUERIES:
+        explain = database.command("explain", {"find": collection, "filter": query}, verbosity="queryPlanner")
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            uncovered.append(f"{description} ({collection}): collection scan")
+    return uncovered
+
+
+def run_migrations(include_long: bool = True) -> [str]:
+    """
+    Runs any migrations in MIGRATIONS that haven't been applied yet and returns their names. Migrations are applied
+    in order, so a pending long migration that is skipped holds back the ones after it.
+
+    Arguments:
+        include_long (bool): whether to run the migrations in LONG_MIGRATIONS
+    """
+
+    database = get_database()
+    applied = {document["_id"] for document in database["Migrations"].find({}, {"_id": 1})}
+    ran = []
+    for migration in MIGRATIONS:
+        if migration.__name__ in applied:
+            continue
+        if migration in LONG_MIGRATIONS and not include_long:
+            logging.warning(f"Migration {migration.__name__} is pending, run `python schema.py migrate` to apply it.")
+            break
+        logging.info(f"Running migration {migration.__name__}.")
+        migration(database)
+        database["Migrations"].insert_one({"_id": migration.__name__, "applied_at": datetime.datetime.now()})
+        ran.append(migration.__name__)
+    return ran
+
+
+def migrate(include_long: bool = True) -> [str]:
+    """
+    Creates indexes and runs pending migrations. Returns a list of problems found.
+
+    Arguments:
+        include_long (bool): whether to run the migrations in LONG_MIGRATIONS, which startup leaves out
+    """
+
+    problems = ensure_indexes()
+    for name in run_migrations(include_long):
+        logging.info(f"Applied migration {name}.")
+    for problem in problems:
+        logging.error(problem)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage PlusWord indexes and migrations.")
+    parser.add_argument(
+        "action",
+        choices=["migrate", "check", "explain"],
+        help="migrate: create indexes and run migrations, check: list missing indexes, "
+             "explain: list hot queries not covered by an index"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cm.get_credentials()
+
+    if args.action == "migrate":
+        problems = migrate()
+    elif args.action == "check":
+        problems = verify_indexes()
+    else:
+        problems = explain_queries()
+
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
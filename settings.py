@@ -0,0 +1,164 @@
+import logging
+import os
+import threading
+from pymongo.errors import PyMongoError
+import db as mongo
+from cache import TTLCache
+
+SETTINGS_TTL = int(os.environ.get("PLUSWORD_SETTINGS_TTL", 600))
+SETTINGS_CACHE_SIZE = int(os.environ.get("PLUSWORD_SETTINGS_CACHE_SIZE", 4096))
+
+# per-user settings collections, each keyed on phone_number
+COLLECTIONS = ("Motivation", "Reminders")
+
+_MISSING = object()
+_PROJECTION = {"_id": 0}
+
+_caches = {collection: TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_TTL) for collection in COLLECTIONS}
+# collections held in full while the change stream keeps them current, so a miss means the user has no settings
+_complete = set()
+_watcher_pid = None
+_lock = threading.Lock()
+
+
+def _ttl(collection: str):
+    # entries of a collection held in full are kept current by the change stream rather than expiring
+    return float("inf") if collection in _complete else None
+
+
+def _set(collection: str, phone_number: str, settings):
+    cache = _caches[collection]
+    cache.set(phone_number, settings, ttl=_ttl(collection))
+    if len(cache) >= cache.maxsize:
+        # entries may have been evicted, so a miss no longer means there are no settings
+        _complete.discard(collection)
+
+
+def get(collection: str, phone_number: str, fresh: bool = False):
+    """
+    Returns a user's settings document from Motivation or Reminders, or None if they have none. Reads through to the
+    database only on a cache miss, unless fresh is set.
+
+    Arguments:
+        collection (str): name of the settings collection
+        phone_number (str): phone number of the user
+        fresh (bool): read from the database and refresh the cache, for commands that decide what to write from
+            the settings, as a cached entry may be stale without a change stream
+    """
+
+    start()
+    if not fresh:
+        settings = _caches[collection].get(phone_number, _MISSING)
+        if settings is not _MISSING:
+            return settings
+        if collection in _complete:
+            return None
+
+    settings = mongo.get_collection("PlusWord", collection).find_one({"phone_number": phone_number}, _PROJECTION)
+    _set(collection, phone_number, settings)
+    return settings
+
+
+def put(collection: str, phone_number: str, fields: dict, upsert: bool = False):
+    """
+    Writes a successful $set of a user's settings through to the cache.
+
+    Arguments:
+        collection (str): name of the settings collection
+        phone_number (str): phone number of the user
+        fields (dict): fields that were set
+        upsert (bool): whether the write created the document if the user had none
+    """
+
+    settings = _caches[collection].get(phone_number, _MISSING)
+    if settings is _MISSING and collection not in _complete:
+        # the rest of the document isn't known, the next read fetches it
+        return
+    if settings in (_MISSING, None):
+        settings = {"phone_number": phone_number} if upsert else None
+    if settings is not None:
+        settings = {**settings, **fields}
+    _set(collection, phone_number, settings)
+
+
+def warm(followed: bool = True):
+    """
+    Loads the settings collections into the cache.
+
+    Arguments:
+        followed (bool): whether a change stream keeps the cache current, in which case each collection that fits is
+            marked as held in full
+    """
+
+    database = mongo.get_client()["PlusWord"]
+    for collection in COLLECTIONS:
+        documents = list(database[collection].find({}, _PROJECTION).limit(SETTINGS_CACHE_SIZE))
+        for settings in documents:
+            _caches[collection].set(settings["phone_number"], settings, ttl=float("inf") if followed else None)
+        if followed and len(documents) < SETTINGS_CACHE_SIZE:
+            _complete.add(collection)
+
+
+def _reset():
+    _complete.clear()
+    for cache in _caches.values():
+        cache.clear()
+
+
+def _follow():
+    """
+    Pre-warms the cache and keeps it current across workers from a change stream on the settings collections.
+    Without change streams the cache falls back to read-through with entries expiring after SETTINGS_TTL.
+    """
+
+    try:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(COLLECTIONS)}}}]
+        with mongo.get_client()["PlusWord"].watch(pipeline, full_document="updateLookup") as stream:
+            # warm once the stream is open so no change made in between is missed
+            warm()
+            for change in stream:
+                collection = change["ns"]["coll"]
+                if settings := change.get("fullDocument"):
+                    settings.pop("_id", None)
+                    _set(collection, settings["phone_number"], settings)
+                else:
+                    # deletes only carry the _id, drop everything rather than guess whose settings they were
+                    _complete.discard(collection)
+                    _caches[collection].clear()
+    except (PyMongoError, NotImplementedError) as ex:
+        logging.warning(f"Settings change stream unavailable, caching settings for {SETTINGS_TTL}s: {ex}")
+        _reset()
+        try:
+            warm(followed=False)
+        except PyMongoError as ex:
+            logging.warning(f"Could not pre-warm settings cache: {ex}")
+        return
+    except Exception as ex:
+        logging.exception(f"Settings change stream failed: {ex}")
+    _reset()
+
+
+def start():
+    """
+    Starts pre-warming the cache and following the change stream in this process, if not already started.
+    """
+
+    global _watcher_pid
+
+    if _watcher_pid == os.getpid():
+        return
+    with _lock:
+        if _watcher_pid != os.getpid():
+            _watcher_pid = os.getpid()
+            _reset()
+            threading.Thread(target=_follow, name="settings-change-stream", daemon=True).start()
+
+
+def _reset_after_fork():
+    global _lock
+
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,34 @@
+import re
+
+DURATION_PATTERN = re.compile(r"(\d+:)?([0-5][0-9]):([0-5][0-9])")
+
+
+def to_seconds(time: str) -> int:
+    """
+    Converts a solve time such as "01:45" or "1:02:03" to whole seconds.
+    Raises ValueError if the string isn't a solve time.
+
+    Arguments:
+        time (str): solve time as [h:]mm:ss
+    """
+
+    match = DURATION_PATTERN.fullmatch(time.strip())
+    if not match:
+        raise ValueError(f"Invalid solve time {time!r}.")
+    hours = int(match.group(1)[:-1]) if match.group(1) else 0
+    return hours * 3600 + int(match.group(2)) * 60 + int(match.group(3))
+
+
+def format_seconds(seconds: int) -> str:
+    """
+    Formats whole seconds as a solve time, mm:ss or h:mm:ss.
+
+    Arguments:
+        seconds (int): solve time in seconds
+    """
+
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes:02}:{seconds:02}"
@@ -0,0 +1,197 @@
+import argparse
+import datetime
+import logging
+import pymongo
+import credential_manager as cm
+import db as mongo
+
+BATCH_SIZE = 1000
+
+
+def get_collection():
+    return mongo.get_collection("PlusWord", "UserStats")
+
+
+def _previous_day(puzzle_date: str) -> str:
+    return (datetime.date.fromisoformat(puzzle_date) - datetime.timedelta(days=1)).isoformat()
+
+
+def queue_submission(batch, phone_number: str, user: str, seconds: int, puzzle_date: str):
+    """
+    Queues a new submission on a write batch, folding it into the user's stats document in one atomic pipeline
+    update.
+
+    Arguments:
+        batch (WriteBatch): write batch the update is queued on
+        phone_number (str): phone number of the user who submitted
+        user (str): username of the user who submitted
+        seconds (int): solve time in seconds
+        puzzle_date (str): puzzle date the time counts towards, YYYY-MM-DD
+    """
+
+    is_new_best = {"$or": [{"$eq": [{"$ifNull": ["$best_seconds", None]}, None]}, {"$lt": [seconds, "$best_seconds"]}]}
+    is_latest = {"$gt": [puzzle_date, {"$ifNull": ["$last_puzzle_date", ""]}]}
+    continues_streak = {"$eq": ["$last_puzzle_date", _previous_day(puzzle_date)]}
+
+    # every expression in a $set stage sees the document as it was before the stage
+    batch.add("UserStats", pymongo.UpdateOne(
+        {"_id": phone_number},
+        [
+            {"$set": {
+                # a profile name is user-controlled and one starting with $ would be read as a field path
+                "user": {"$literal": user},
+                "count": {"$add": [{"$ifNull": ["$count", 0]}, 1]},
+                "total_seconds": {"$add": [{"$ifNull": ["$total_seconds", 0]}, seconds]},
+                "best_seconds": {"$min": [{"$ifNull": ["$best_seconds", seconds]}, seconds]},
+                "best_date": {"$cond": [is_new_best, puzzle_date, "$best_date"]},
+                # a retro submission for an earlier day leaves the current streak alone, rebuild() recounts it
+                "current_streak": {"$cond": [
+                    is_latest,
+                    {"$cond": [continues_streak, {"$add": ["$current_streak", 1]}, 1]},
+                    {"$ifNull": ["$current_streak", 1]}
+                ]},
+                "last_puzzle_date": {"$cond": [is_latest, puzzle_date, "$last_puzzle_date"]},
+                "updated_at": datetime.datetime.now(),
+            }},
+            {"$set": {"longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]}}},
+        ],
+        upsert=True
+    ))
+
+
+def record_edit(phone_number: str, old_seconds: int, seconds: int, puzzle_date: str):
+    """
+    Applies an edited time to the user's stats document.
+
+    Arguments:
+        phone_number (str): phone number of the user who edited their time
+        old_seconds (int): solve time in seconds before the edit
+        seconds (int): solve time in seconds after the edit
+        puzzle_date (str): puzzle date of the edited time, YYYY-MM-DD
+    """
+
+    collection = get_collection()
+    before = collection.find_one_and_update(
+        {"_id": phone_number},
+        [{"$set": {
+            "total_seconds": {"$add": ["$total_seconds", seconds - old_seconds]},
+            "best_seconds": {"$min": ["$best_seconds", seconds]},
+            "best_date": {"$cond": [{"$lt": [seconds, "$best_seconds"]}, puzzle_date, "$best_date"]},
+            "updated_at": datetime.datetime.now(),
+        }}],
+        projection={"best_seconds": 1}
+    )
+
+    if before is not None and seconds > old_seconds and old_seconds == before.get("best_seconds"):
+        # the personal best was made slower, so it may now belong to another day
+        best = mongo.get_collection("PlusWord", "Times").find_one(
+            {"phone_number": phone_number, "seconds": {"$exists": True}},
+            {"seconds": 1, "puzzle_date": 1},
+            sort=[("seconds", pymongo.ASCENDING)]
+        )
+        if best is not None:
+            collection.update_one(
+                {"_id": phone_number},
+                {"$set": {"best_seconds": best["seconds"], "best_date": best.get("puzzle_date")}}
+            )
+
+
+def get_stats(phone_number: str):
+    """
+    Returns the user's stats document, or None if they have never submitted.
+
+    Arguments:
+        phone_number (str): phone number of the user
+    """
+
+    return get_collection().find_one({"_id": phone_number})
+
+
+def current_streak(stats: dict) -> int:
+    """
+    Returns the user's current streak, which is broken once a whole day passes without a submission.
+
+    Arguments:
+        stats (dict): the user's stats document
+    """
+
+    today = datetime.date.today()
+    if stats.get("last_puzzle_date") in (today.isoformat(), (today - datetime.timedelta(days=1)).isoformat()):
+        return stats.get("current_streak", 0)
+    return 0
+
+
+def _streaks(puzzle_dates: [str]) -> (int, int):
+    """
+    Returns the final and longest run of consecutive days in a sorted list of puzzle dates.
+    """
+
+    current = longest = 0
+    previous = None
+    for puzzle_date in puzzle_dates:
+        day = datetime.date.fromisoformat(puzzle_date)
+        current = current + 1 if previous is not None and day - previous == datetime.timedelta(days=1) else 1
+        longest = max(longest, current)
+        previous = day
+    return current, longest
+
+
+def rebuild(database=None):
+    """
+    Recomputes every user's stats document from Times in bulk.
+
+    Arguments:
+        database: PlusWord database to rebuild, defaults to the shared client's
+    """
+
+    database = database if database is not None else mongo.get_client()["PlusWord"]
+    cursor = database["Times"].aggregate([
+        {"$match": {"seconds": {"$exists": True}, "puzzle_date": {"$exists": True}}},
+        {"$sort": {"puzzle_date": pymongo.ASCENDING}},
+        {"$group": {
+            "_id": "$phone_number",
+            "user": {"$last": "$user"},
+            "count": {"$sum": 1},
+            "total_seconds": {"$sum": "$seconds"},
+            "best_seconds": {"$min": "$seconds"},
+            "entries": {"$push": {"puzzle_date": "$puzzle_date", "seconds": "$seconds"}},
+        }},
+    ], allowDiskUse=True)
+
+    batch = []
+    now = datetime.datetime.now()
+    for group in cursor:
+        puzzle_dates = [entry["puzzle_date"] for entry in group["entries"]]
+        current, longest = _streaks(puzzle_dates)
+        best_date = next(entry["puzzle_date"] for entry in group["entries"]
+                         if entry["seconds"] == group["best_seconds"])
+        batch.append(pymongo.ReplaceOne({"_id": group["_id"]}, {
+            "user": group["user"],
+            "count": group["count"],
+            "total_seconds": group["total_seconds"],
+            "best_seconds": group["best_seconds"],
+            "best_date": best_date,
+            "current_streak": current,
+            "longest_streak": longest,
+            "last_puzzle_date": puzzle_dates[-1],
+            "updated_at": now,
+        }, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            database["UserStats"].bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        database["UserStats"].bulk_write(batch, ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain PlusWord user stats.")
+    parser.add_argument("action", choices=["rebuild"], help="rebuild: recompute every user's stats from Times")
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cm.get_credentials()
+    rebuild()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import datetime
+import os
+import threading
+import db as mongo
+
+_day = None
+_phone_numbers = set()
+_lock = threading.Lock()
+
+
+def _today() -> str:
+    return datetime.date.today().isoformat()
+
+
+def seed():
+    """
+    Loads who has submitted a time for today's puzzle with one projected query, replacing the set for the previous
+    day.
+    """
+
+    global _day, _phone_numbers
+
+    day = _today()
+    phone_numbers = {
+        submission["phone_number"]
+        for submission in mongo.get_collection("PlusWord", "Times").find(
+            {"puzzle_date": day}, {"_id": 0, "phone_number": 1}
+        )
+    }
+    with _lock:
+        if _day == day:
+            # keep anything added while the query ran
+            phone_numbers |= _phone_numbers
+        _day, _phone_numbers = day, phone_numbers
+
+
+def _current() -> set:
+    """
+    Returns the set for today, reseeding it on the first use in this process and after midnight.
+    """
+
+    if _day != _today():
+        seed()
+    return _phone_numbers
+
+
+def has_submitted(phone_number: str) -> bool:
+    """
+    Returns True if the user is known to have submitted a time for today's puzzle. Other workers' submissions are only
+    known once this process has seen them, so False means the database has to be asked.
+
+    Arguments:
+        phone_number (str): phone number of the user
+    """
+
+    return phone_number in _current()
+
+
+def add(phone_number: str, puzzle_date: str):
+    """
+    Records that a user has a time for a puzzle date, ignored unless the date is today.
+
+    Arguments:
+        phone_number (str): phone number of the user
+        puzzle_date (str): puzzle date of the time, YYYY-MM-DD
+    """
+
+    if puzzle_date == _today():
+        _current().add(phone_number)
+
+
+def _reset_after_fork():
+    global _day, _phone_numbers, _lock
+
+    _day = None
+    _phone_numbers = set()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
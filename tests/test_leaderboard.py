@@ -0,0 +1,92 @@
+import datetime
+import pytest
+import leaderboard
+import solve_time
+from write_batch import WriteBatch
+
+DAY = "2024-01-01"
+START = datetime.datetime(2024, 1, 1, 8)
+
+
+@pytest.fixture
+def board_size(monkeypatch):
+    monkeypatch.setattr(leaderboard, "LEADERBOARD_SIZE", 3)
+    return 3
+
+
+def submit(database, phone_number: str, time: str, minute: int):
+    """
+    Stores a time the way a submission does and returns the placing it was replied with.
+    """
+
+    seconds = solve_time.to_seconds(time)
+    load_ts = START + datetime.timedelta(minutes=minute)
+    database["Times"].insert_one({
+        "phone_number": phone_number, "user": f"User {phone_number}", "time": time, "seconds": seconds,
+        "load_ts": load_ts, "puzzle_date": DAY,
+    })
+    placings = []
+    batch = WriteBatch(database)
+    leaderboard.queue_submission(
+        batch, DAY, phone_number, f"User {phone_number}", seconds, time, load_ts, placings.append
+    )
+    batch.flush()
+    return placings[0]
+
+
+def edit(database, phone_number: str, time: str):
+    """
+    Edits a stored time the way !edit does and returns the placing it was replied with.
+    """
+
+    seconds = solve_time.to_seconds(time)
+    previous = database["Times"].find_one_and_update(
+        {"phone_number": phone_number, "puzzle_date": DAY}, {"$set": {"time": time, "seconds": seconds}}
+    )
+    return leaderboard.record_edit(DAY, phone_number, f"User {phone_number}", seconds, time, previous["load_ts"])
+
+
+def board_times(database) -> [str]:
+    return [entry["time"] for entry in leaderboard.get_leaderboard(DAY)["entries"]]
+
+
+@pytest.fixture
+def full_board(database, board_size):
+    for index, time in enumerate(["00:30", "00:40", "00:50", "01:00", "01:10"]):
+        submit(database, str(index + 1), time, index)
+    return database
+
+
+def test_submissions_keep_only_the_fastest_times(database, board_size):
+    # mongomock's $push $sort only honours the last sort key, so times are submitted in load_ts order
+    assert submit(database, "1", "00:30", 0) == (1, 1)
+    assert submit(database, "2", "00:40", 1) == (2, 2)
+    assert submit(database, "3", "00:50", 2) == (3, 3)
+    assert submit(database, "4", "01:00", 3) == (4, 4)
+    assert submit(database, "5", "01:10", 4) == (5, 5)
+    assert board_times(database) == ["00:30", "00:40", "00:50"]
+
+
+def test_edit_made_slower_off_a_full_board_is_ranked_against_every_time(full_board):
+    assert edit(full_board, "1", "05:00") == (5, 5)
+    assert board_times(full_board) == ["00:40", "00:50", "01:00"]
+
+
+def test_edit_made_slower_to_the_last_place_refills_the_board(full_board):
+    assert edit(full_board, "1", "00:55") == (3, 5)
+    assert board_times(full_board) == ["00:40", "00:50", "00:55"]
+
+
+def test_edit_made_slower_within_the_board_keeps_its_order(full_board):
+    assert edit(full_board, "1", "00:45") == (2, 5)
+    assert board_times(full_board) == ["00:40", "00:45", "00:50"]
+
+
+def test_edit_made_faster_onto_the_board(full_board):
+    assert edit(full_board, "5", "00:20") == (1, 5)
+    assert board_times(full_board) == ["00:20", "00:30", "00:40"]
+
+
+def test_edit_that_stays_off_the_board(full_board):
+    assert edit(full_board, "5", "01:05") == (5, 5)
+    assert board_times(full_board) == ["00:30", "00:40", "00:50"]
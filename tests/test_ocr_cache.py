@@ -0,0 +1,92 @@
+import io
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+import ocr
+import ocr_cache
+
+# segments lit for each digit, as (left, top, right, bottom) in a 4x7 cell
+SEGMENTS = {
+    "a": (0, 0, 4, 1), "b": (3, 0, 4, 4), "c": (3, 3, 4, 7), "d": (0, 6, 4, 7),
+    "e": (0, 3, 1, 7), "f": (0, 0, 1, 4), "g": (0, 3, 4, 4),
+}
+DIGITS = {
+    "0": "abcdef", "1": "bc", "2": "abdeg", "3": "abcdg", "4": "bcfg",
+    "5": "acdfg", "6": "acdefg", "7": "abc", "8": "abcdefg", "9": "abcdfg",
+}
+
+
+def screenshot(time: str, blur: float = 0) -> bytes:
+    """
+    Draws a completion screenshot showing a time in seven segment digits and encodes it as a JPEG, blurred to
+    stand in for a lossy re-encode that moves some grid cells across the threshold.
+    """
+
+    image = Image.new("RGB", (1080, 2340), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1080, 200), fill=(30, 60, 120))
+    scale, left = 18, 300
+    for character in time:
+        if character == ":":
+            draw.rectangle((left, 950, left + scale, 950 + scale), fill=(20, 20, 20))
+            draw.rectangle((left, 1030, left + scale, 1030 + scale), fill=(20, 20, 20))
+            left += 2 * scale
+            continue
+        for segment in DIGITS[character]:
+            x0, y0, x1, y1 = SEGMENTS[segment]
+            draw.rectangle((left + x0 * scale, 900 + y0 * scale, left + x1 * scale, 900 + y1 * scale),
+                           fill=(20, 20, 20))
+        left += 6 * scale
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(blur))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+@pytest.fixture
+def reads(database, monkeypatch):
+    """
+    Replaces OCR with a lookup of the time each screenshot was drawn with, recording every time OCR runs.
+    """
+
+    monkeypatch.setattr(ocr_cache, "_local", ocr_cache.TTLCache())
+    shown, reads = {}, []
+
+    def read_time_from_image(image):
+        reads.append(image)
+        return shown["time"]
+
+    def fetch(media_id):
+        # media ids are the time shown and the blur, e.g. "01:23/2"
+        shown["time"], blur = media_id.split("/")
+        return screenshot(shown["time"], float(blur))
+
+    monkeypatch.setattr(ocr, "read_time_from_image", read_time_from_image)
+    return lambda media_id: ocr_cache.read_time(media_id, fetch), reads
+
+
+def test_re_encoded_copy_skips_ocr(reads):
+    read_time, ocr_runs = reads
+
+    assert read_time("01:23/0") == "01:23"
+    assert read_time("01:23/2") == "01:23"
+    assert read_time("01:23/0") == "01:23"
+    assert len(ocr_runs) == 1
+
+
+def test_screenshots_with_different_times_are_read(reads):
+    read_time, ocr_runs = reads
+
+    for time in ("01:23", "01:28", "01:29", "11:23", "1:01:23"):
+        assert read_time(f"{time}/0") == time
+    assert len(ocr_runs) == 5
+
+
+def test_hash_of_a_re_encoded_copy_is_close():
+    original = ocr_cache.perceptual_hash(ocr.decode_image(screenshot("01:23")))
+    copy = ocr_cache.perceptual_hash(ocr.decode_image(screenshot("01:23", blur=2)))
+    other = ocr_cache.perceptual_hash(ocr.decode_image(screenshot("01:28")))
+
+    assert original[0] == copy[0] == other[0]
+    assert 0 < ocr_cache.hamming(original[1], copy[1]) <= ocr_cache.PHASH_DISTANCE
+    assert ocr_cache.hamming(original[1], other[1]) > ocr_cache.PHASH_DISTANCE
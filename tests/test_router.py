@@ -0,0 +1,18 @@
+from types import SimpleNamespace
+from router import CommandRouter
+
+
+def text(body: str):
+    return SimpleNamespace(type="text", msg_text=body)
+
+
+def test_command_name_stops_at_the_first_non_letter():
+    router = CommandRouter()
+    submit = router.command("!submit")(lambda bot: None)
+    unknown = router.unknown(lambda bot: None)
+
+    assert router.resolve(text("!submit01:45")) is submit
+    assert router.resolve(text("!submit 01:45")) is submit
+    assert router.route(text("!submit01:45")) == "!submit"
+    assert router.resolve(text("!submitted")) is unknown
+    assert router.resolve(text("hello")) is unknown
@@ -0,0 +1,93 @@
+import datetime
+import stats
+import solve_time
+from write_batch import WriteBatch
+
+
+def submit(database, phone_number: str, time: str, puzzle_date: str, user: str = "User"):
+    """
+    Stores a time the way a submission does and folds it into the user's stats.
+    """
+
+    seconds = solve_time.to_seconds(time)
+    database["Times"].insert_one({
+        "phone_number": phone_number, "user": user, "time": time, "seconds": seconds,
+        "load_ts": datetime.datetime.fromisoformat(puzzle_date), "puzzle_date": puzzle_date,
+    })
+    batch = WriteBatch(database)
+    stats.queue_submission(batch, phone_number, user, seconds, puzzle_date)
+    batch.flush()
+
+
+def edit(database, phone_number: str, time: str, puzzle_date: str):
+    """
+    Edits a stored time the way !edit does and applies it to the user's stats.
+    """
+
+    seconds = solve_time.to_seconds(time)
+    previous = database["Times"].find_one_and_update(
+        {"phone_number": phone_number, "puzzle_date": puzzle_date}, {"$set": {"time": time, "seconds": seconds}}
+    )
+    stats.record_edit(phone_number, previous["seconds"], seconds, puzzle_date)
+
+
+def test_profile_name_is_stored_as_sent(database):
+    submit(database, "1", "01:00", "2024-01-01", user="$count")
+    submit(database, "2", "01:00", "2024-01-01", user="$$ROOT")
+
+    assert stats.get_stats("1")["user"] == "$count"
+    assert stats.get_stats("2")["user"] == "$$ROOT"
+
+
+def test_submissions_totals_and_best(database):
+    submit(database, "1", "01:00", "2024-01-01")
+    submit(database, "1", "00:40", "2024-01-02")
+    submit(database, "1", "01:20", "2024-01-03")
+
+    user_stats = stats.get_stats("1")
+    assert user_stats["count"] == 3
+    assert user_stats["total_seconds"] == 180
+    assert user_stats["best_seconds"] == 40
+    assert user_stats["best_date"] == "2024-01-02"
+
+
+def test_streaks_continue_on_consecutive_days_and_reset_after_a_gap(database):
+    for puzzle_date in ("2024-01-01", "2024-01-02", "2024-01-03", "2024-01-05", "2024-01-06"):
+        submit(database, "1", "01:00", puzzle_date)
+
+    user_stats = stats.get_stats("1")
+    assert user_stats["current_streak"] == 2
+    assert user_stats["longest_streak"] == 3
+    assert user_stats["last_puzzle_date"] == "2024-01-06"
+
+
+def test_retro_submission_leaves_the_current_streak_alone(database):
+    submit(database, "1", "01:00", "2024-01-05")
+    submit(database, "1", "01:00", "2024-01-06")
+    submit(database, "1", "01:00", "2024-01-01")
+
+    user_stats = stats.get_stats("1")
+    assert user_stats["current_streak"] == 2
+    assert user_stats["last_puzzle_date"] == "2024-01-06"
+
+
+def test_edit_made_faster_sets_a_new_best(database):
+    submit(database, "1", "01:00", "2024-01-01")
+    submit(database, "1", "00:50", "2024-01-02")
+    edit(database, "1", "00:30", "2024-01-01")
+
+    user_stats = stats.get_stats("1")
+    assert user_stats["total_seconds"] == 80
+    assert user_stats["best_seconds"] == 30
+    assert user_stats["best_date"] == "2024-01-01"
+
+
+def test_edit_made_slower_moves_the_best_to_another_day(database):
+    submit(database, "1", "00:30", "2024-01-01")
+    submit(database, "1", "00:50", "2024-01-02")
+    edit(database, "1", "01:10", "2024-01-01")
+
+    user_stats = stats.get_stats("1")
+    assert user_stats["total_seconds"] == 120
+    assert user_stats["best_seconds"] == 50
+    assert user_stats["best_date"] == "2024-01-02"
@@ -0,0 +1,36 @@
+import threading
+import time
+from work_queue import WorkQueue
+
+
+def test_items_with_the_same_key_are_handled_in_order():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(item):
+        sender, number = item
+        # the first item of each sender is the slowest, so a second worker would overtake it
+        time.sleep(0.05 if number == 0 else 0)
+        with lock:
+            handled.setdefault(sender, []).append(number)
+
+    work = WorkQueue(handle, workers=4, maxsize=100, key=lambda item: item[0])
+    for number in range(5):
+        for sender in ("a", "b", "c"):
+            assert work.submit((sender, number))
+    work.shutdown()
+
+    assert handled == {sender: [0, 1, 2, 3, 4] for sender in ("a", "b", "c")}
+    assert work.qsize() == 0
+
+
+def test_full_worker_queue_rejects_items():
+    release = threading.Event()
+    work = WorkQueue(lambda item: release.wait(1), workers=2, maxsize=2, key=lambda item: "same")
+    results = [work.submit(number) for number in range(4)]
+    release.set()
+    work.shutdown()
+
+    # every item goes to the same worker, whose queue holds one item besides the one it may have taken already
+    assert results[0]
+    assert results.count(False) >= 2
@@ -0,0 +1,60 @@
+import mongomock
+import pymongo
+import pytest
+from pymongo.errors import AutoReconnect
+import dedup
+from write_batch import WriteBatch
+
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    """
+    Makes every bulk_write to the Broken collection fail as a whole, as it would on a lost connection.
+    """
+
+    bulk_write = mongomock.collection.Collection.bulk_write
+
+    def failing(collection, *args, **kwargs):
+        if collection.name == "Broken":
+            raise AutoReconnect("connection lost")
+        return bulk_write(collection, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", failing)
+
+
+def test_failed_bulk_write_reaches_every_callback(database, unreachable):
+    outcomes = []
+    batch = WriteBatch(database)
+    batch.key = "message-1"
+    batch.add("Broken", pymongo.InsertOne({"_id": 1}), lambda upserted_id, error: outcomes.append(error))
+    batch.add("Broken", pymongo.InsertOne({"_id": 2}), lambda upserted_id, error: outcomes.append(error))
+    batch.key = "message-2"
+    batch.add("Working", pymongo.InsertOne({"_id": 1}), lambda upserted_id, error: outcomes.append(error))
+    batch.flush()
+
+    assert [error and error["errmsg"] for error in outcomes] == ["connection lost", "connection lost", None]
+    assert database["Working"].count_documents({}) == 1
+
+
+def test_failures_are_recorded_against_the_message_that_queued_them(database, unreachable):
+    def queue_follow_up(upserted_id, error):
+        batch.add("Broken", pymongo.InsertOne({"_id": 1}))
+
+    batch = WriteBatch(database)
+    batch.key = "message-1"
+    batch.add("Working", pymongo.InsertOne({"_id": 1}), queue_follow_up)
+    batch.key = "message-2"
+    batch.add("Working", pymongo.InsertOne({"_id": 2}))
+    batch.key = "message-3"
+    batch.add("Working", pymongo.InsertOne({"_id": 3}), lambda upserted_id, error: 1 / 0)
+    batch.flush()
+
+    assert batch.failed == {"message-1", "message-3"}
+
+
+def test_released_messages_can_be_claimed_again(database):
+    assert dedup.claim(["message-1", "message-2"]) == set()
+    dedup.release(["message-1"])
+
+    assert not dedup.seen("message-1")
+    assert dedup.claim(["message-1", "message-2"]) == {"message-2"}
@@ -0,0 +1,125 @@
+import contextvars
+import itertools
+import logging
+import os
+import queue
+import threading
+
+_STOP = object()
+
+
+class WorkQueue:
+    """
+    Bounded queue drained by a pool of background worker threads. Each worker drains its own queue, and items with
+    the same key always go to the same worker, so they're processed one at a time in the order they were submitted.
+
+    Attributes:
+        handler: callable run by the workers for each queued item
+        workers (int): number of worker threads
+        maxsize (int): maximum number of items waiting to be processed, split evenly between the workers
+        key: called as key(item) to pick the item's worker, items are spread over the workers in turn if None
+    """
+
+    def __init__(self, handler, workers: int = 4, maxsize: int = 100, key=None):
+        """
+        Constructor for WorkQueue class.
+
+        Arguments:
+            handler: callable run by the workers for each queued item
+            workers (int): number of worker threads
+            maxsize (int): maximum number of items waiting to be processed, split evenly between the workers
+            key: called as key(item) to pick the item's worker, items are spread over the workers in turn if None
+        """
+
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.key = key
+        self._queues = []
+        self._turn = itertools.count()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _ensure_started(self):
+        """
+        Starts the worker threads in the current process. Threads do not survive a fork, so a queue inherited from a
+        parent process is rebuilt.
+        """
+
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queues = [queue.Queue(maxsize=max(1, self.maxsize // self.workers)) for _ in range(self.workers)]
+            self._threads = [
+                threading.Thread(target=self._run, args=(self._queues[i],), name=f"work-queue-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._closed = False
+            self._pid = os.getpid()
+
+    def submit(self, item, timeout: float = 0.0) -> bool:
+        """
+        Queues an item on its worker's queue. Returns False if that queue is full or shutting down so the caller can
+        apply backpressure.
+
+        Arguments:
+            item: item passed to the handler
+            timeout (float): seconds to wait for a free slot before giving up
+        """
+
+        self._ensure_started()
+        if self._closed:
+            return False
+
+        shard = next(self._turn) if self.key is None else hash(self.key(item))
+        work = self._queues[shard % self.workers]
+        try:
+            # run the handler in a copy of the submitter's context, so it logs with the same request id
+            work.put((contextvars.copy_context(), item), block=timeout > 0, timeout=timeout or None)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self, work: queue.Queue):
+        while True:
+            item = work.get()
+            try:
+                if item is _STOP:
+                    return
+                context, item = item
+                context.run(self.handler, item)
+            except Exception as ex:
+                logging.exception(f"Work queue handler failed: {ex}")
+            finally:
+                work.task_done()
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Stops accepting new items, lets the workers finish everything already queued and waits for them to exit.
+
+        Arguments:
+            timeout (float): seconds to wait for each worker to finish
+        """
+
+        if self._pid != os.getpid() or self._closed:
+            return
+
+        self._closed = True
+        for work in self._queues:
+            work.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def qsize(self) -> int:
+        """
+        Returns the approximate number of items waiting to be processed.
+        """
+
+        return sum(work.qsize() for work in self._queues) if self._pid == os.getpid() else 0
@@ -0,0 +1,120 @@
+import logging
+from pymongo.errors import BulkWriteError, PyMongoError
+import db as mongo
+import metrics
+
+WRITE_SECONDS = metrics.histogram(
+    "plusword_mongo_write_seconds",
+    "Time taken by each batch's bulk_write, by collection.",
+    ("collection",)
+)
+
+
+class WriteBatch:
+    """
+    Collects the DB writes made while handling a webhook payload and runs each collection's writes as one unordered
+    bulk_write. Callers pass a callback with each write to learn its outcome once the batch is flushed, and callbacks
+    may queue further writes, which are flushed in a following round.
+    Each write is recorded against the key current when it was queued, writes queued by a callback taking its
+    write's key, and the keys of writes that failed are collected in failed.
+
+    Attributes:
+        database: PlusWord database the writes are made to
+        key: key writes queued now are recorded against, e.g. the id of the message being handled
+        failed (set): keys of writes that failed or whose callback raised
+    """
+
+    def __init__(self, database=None):
+        """
+        Constructor for WriteBatch class.
+
+        Arguments:
+            database: PlusWord database to write to, defaults to the shared client's
+        """
+
+        self.database = database if database is not None else mongo.get_client()["PlusWord"]
+        self.key = None
+        self.failed = set()
+        self._writes = {}
+        self._after = {}
+
+    def add(self, collection: str, operation, callback=None):
+        """
+        Queues a write.
+
+        Arguments:
+            collection (str): name of the collection to write to
+            operation: pymongo write operation, e.g. UpdateOne
+            callback: called as callback(upserted_id, error) once written, error being the write error or None
+        """
+
+        self._writes.setdefault(collection, []).append((operation, callback, self.key))
+
+    def after(self, name: str, item, handler):
+        """
+        Queues an item for a follow-up that runs once the writes are flushed. Every item queued under the same name
+        is handed to a single handler(items) call, so follow-up reads can be made in bulk too.
+
+        Arguments:
+            name (str): name grouping the items
+            item: item passed on to the handler
+            handler: called as handler(items) with every item queued under the name
+        """
+
+        self._after.setdefault(name, (handler, []))[1].append(item)
+
+    def flush(self):
+        """
+        Runs every queued write, one bulk_write per collection, then the callbacks and follow-ups, until nothing
+        is left queued.
+        """
+
+        while self._writes or self._after:
+            while self._writes:
+                writes, self._writes = self._writes, {}
+                for collection, operations in writes.items():
+                    self._write(collection, operations)
+
+            after, self._after = self._after, {}
+            for name, (handler, items) in after.items():
+                run_callback(handler, items)
+
+    def _write(self, collection: str, operations: list):
+        upserted_ids = {}
+        errors = {}
+        try:
+            with metrics.timed("mongo_write", WRITE_SECONDS, collection=collection):
+                result = self.database[collection].bulk_write([op for op, _, _ in operations], ordered=False)
+            upserted_ids = result.upserted_ids or {}
+        except BulkWriteError as ex:
+            upserted_ids = {upsert["index"]: upsert["_id"] for upsert in ex.details.get("upserted", [])}
+            errors = {error["index"]: error for error in ex.details.get("writeErrors", [])}
+        except PyMongoError as ex:
+            # the whole bulk_write failed, e.g. on a timeout, so none of its writes can be assumed to have been made
+            errors = {index: {"index": index, "code": None, "errmsg": str(ex)} for index in range(len(operations))}
+
+        key = self.key
+        try:
+            for index, (operation, callback, self.key) in enumerate(operations):
+                if callback is not None:
+                    if not run_callback(callback, upserted_ids.get(index), errors.get(index)):
+                        self.failed.add(self.key)
+                elif index in errors:
+                    logging.error(f"Write to {collection} failed: {errors[index].get('errmsg')}")
+                    self.failed.add(self.key)
+        finally:
+            self.key = key
+
+
+def run_callback(callback, *args):
+    """
+    Runs a callback, logging rather than raising its exceptions so one message can't stop the rest of the batch.
+    Returns whether it ran without raising.
+    """
+
+    try:
+        callback(*args)
+        return True
+    except Exception as ex:
+        logging.exception(f"Write batch callback failed: {ex}")
+        return False